@@ -0,0 +1,158 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict
+
+from fastapi import HTTPException, Request
+
+from metrics import ADMISSION_REJECTIONS, PANEL_BUDGET_USED
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+# Generation requests per second per client, and the burst a client may save up
+CLIENT_RATE = float(os.environ.get('RATE_LIMIT_PER_CLIENT', 2))
+CLIENT_BURST = float(os.environ.get('RATE_LIMIT_CLIENT_BURST', 10))
+# The same for all clients together
+GLOBAL_RATE = float(os.environ.get('RATE_LIMIT_GLOBAL', 20))
+GLOBAL_BURST = float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', 50))
+# Panels accepted but not generated yet, across all requests and jobs
+PANEL_BUDGET = int(os.environ.get('PANEL_BUDGET', 500))
+# Retry-After when the panel budget is full; the queue drains at SD speed
+BUDGET_RETRY_SECONDS = int(os.environ.get('ADMISSION_BUDGET_RETRY_SECONDS', 30))
+# Header identifying a client (e.g. X-API-Key); the peer address otherwise.
+# Only set it to X-Forwarded-For behind a proxy that overwrites it.
+CLIENT_HEADER = os.environ.get('ADMISSION_CLIENT_HEADER')
+MAX_TRACKED_CLIENTS = 10000
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average, bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, tokens: float = 1) -> float:
+        """Take tokens if available: 0, else the seconds until they will be"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate if self.rate > 0 else float(BUDGET_RETRY_SECONDS)
+
+    def refund(self, tokens: float = 1):
+        self.tokens = min(self.burst, self.tokens + tokens)
+
+
+class Reservation:
+    """Panels held in the budget by one request; released as they are generated"""
+
+    def __init__(self, controller: "AdmissionController", panels: int):
+        self._controller = controller
+        self.remaining = panels
+
+    def release(self, panels: int = 1):
+        panels = min(panels, self.remaining)
+        if panels > 0:
+            self.remaining -= panels
+            self._controller._release(panels)
+
+    def close(self):
+        """Give back whatever is still held (finished, failed or cancelled work)"""
+        self.release(self.remaining)
+
+
+class AdmissionController:
+    """Token-bucket rate limits per client and overall, plus a pending-panel budget.
+
+    Rejections are cheap and early: a client over its rate gets 429 before
+    any database work; a service over its global rate or panel budget
+    answers 503. Both carry Retry-After.
+    """
+
+    def __init__(self, client_rate: float = CLIENT_RATE, client_burst: float = CLIENT_BURST,
+                 global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 panel_budget: int = PANEL_BUDGET, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.panel_budget = panel_budget
+        self.panels_pending = 0
+        self._global = TokenBucket(global_rate, global_burst)
+        self._clients: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check_rate(self, client: str, endpoint: str):
+        """Raise 429 if the client is over its rate, 503 if the service as a whole is"""
+        if not self.enabled:
+            return
+        with self._lock:
+            bucket = self._clients.get(client)
+            if bucket is None:
+                bucket = self._clients[client] = TokenBucket(self.client_rate, self.client_burst)
+                if len(self._clients) > MAX_TRACKED_CLIENTS:
+                    self._clients.popitem(last=False)
+            self._clients.move_to_end(client)
+
+            wait = bucket.take()
+            if wait:
+                self._reject(endpoint, "client_rate", 429, wait, "Too many generation requests from this client")
+            wait = self._global.take()
+            if wait:
+                # The client's token wasn't used, give it back
+                bucket.refund()
+                self._reject(endpoint, "global_rate", 503, wait, "Generation is at capacity, try again later")
+
+    def reserve(self, panels: int, endpoint: str) -> Reservation:
+        """Hold budget for `panels`, or raise 503 if the backlog is full"""
+        if not self.enabled:
+            return Reservation(self, 0)
+        with self._lock:
+            if self.panels_pending + panels > self.panel_budget:
+                if panels > self.panel_budget:
+                    ADMISSION_REJECTIONS.labels(endpoint, "too_large").inc()
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Request needs {panels} panels; at most {self.panel_budget} can be queued"
+                    )
+                self._reject(endpoint, "panel_budget", 503, BUDGET_RETRY_SECONDS,
+                             "Generation queue is full, try again later")
+            self.panels_pending += panels
+            PANEL_BUDGET_USED.set(self.panels_pending)
+        return Reservation(self, panels)
+
+    def _release(self, panels: int):
+        with self._lock:
+            self.panels_pending = max(0, self.panels_pending - panels)
+            PANEL_BUDGET_USED.set(self.panels_pending)
+
+    @staticmethod
+    def _reject(endpoint: str, reason: str, status_code: int, retry_after: float, detail: str):
+        ADMISSION_REJECTIONS.labels(endpoint, reason).inc()
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "panels_pending": self.panels_pending,
+            "panel_budget": self.panel_budget,
+            "tracked_clients": len(self._clients),
+        }
+
+
+def client_id(request: Request) -> str:
+    """Who a request is rate limited as"""
+    if CLIENT_HEADER:
+        value = request.headers.get(CLIENT_HEADER)
+        if value:
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
@@ -0,0 +1,75 @@
+import os
+import json
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from script_parser import ScriptParser
+
+# Items written per transaction; also the unit handed to the parse workers
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+# Cap for JSON array bodies, which are held in memory whole (NDJSON is streamed)
+IMPORT_MAX_ITEMS = int(os.environ.get('IMPORT_MAX_ITEMS', 10000))
+
+
+@lru_cache(maxsize=None)
+def _parser() -> ScriptParser:
+    return ScriptParser()
+
+
+def parse_scripts(contents: List[str]) -> List[Tuple[Any, Any]]:
+    """(parsed_data, None) or (None, error) per script; runs in a worker process"""
+    results = []
+    for content in contents:
+        try:
+            results.append((_parser().parse_script(content), None))
+        except Exception as e:
+            results.append((None, f"Error parsing script: {str(e)}"))
+    return results
+
+
+def chunked(items: List[Any], parts: int) -> List[List[Any]]:
+    """Split items into at most `parts` contiguous, roughly equal chunks"""
+    size = -(-len(items) // max(parts, 1)) or 1
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def ndjson_batches(stream: AsyncIterator[bytes], batch_size: int = IMPORT_BATCH_SIZE) -> AsyncIterator[List[Tuple[int, Any]]]:
+    """(line index, decoded object or ValueError) batches from a streamed NDJSON body"""
+    batch: List[Tuple[int, Any]] = []
+    buffer = b""
+    index = 0
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                batch.append((index, _decode_line(line)))
+                index += 1
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    if buffer.strip():
+        batch.append((index, _decode_line(buffer)))
+    if batch:
+        yield batch
+
+
+def _decode_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {str(e)}")
+
+
+def item_error(error: Exception) -> str:
+    """One-line message for an item that failed validation"""
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in error.errors())
+    return str(error)
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    failed = sum(1 for result in results if result.get('error'))
+    return {"imported": len(results) - failed, "failed": failed, "results": results}
@@ -0,0 +1,171 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Minimum trigram similarity for a fuzzy name hit
+SEARCH_THRESHOLD = 0.3
+# Script names must be closer than that before they're linked to a character
+RESOLVE_THRESHOLD = 0.5
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Case-, accent- and punctuation-insensitive form of a name or tag"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_WORD.findall(text.casefold()))
+
+
+def trigrams(text: str) -> Set[str]:
+    """pg_trgm-style trigrams: each word padded with two leading blanks and one trailing"""
+    grams = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class CharacterIndex:
+    """In-memory search index over characters.
+
+    Tags go into an inverted index (normalized tag -> ids) and names into
+    a trigram index (trigram -> ids), so a search only looks at characters
+    sharing a tag or a trigram with the query rather than the whole table.
+    The API keeps it in step with the database on create and delete.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._characters: Dict[str, Dict[str, Any]] = {}
+        self._name_grams: Dict[str, List[Set[str]]] = {}
+        self._by_tag: Dict[str, Set[str]] = defaultdict(set)
+        self._by_gram: Dict[str, Set[str]] = defaultdict(set)
+        self._by_name: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._characters)
+
+    def load(self, characters: Iterable[Dict[str, Any]]):
+        """Replace the index contents, e.g. from a full table scan"""
+        with self._lock:
+            self._characters.clear()
+            self._name_grams.clear()
+            self._by_tag.clear()
+            self._by_gram.clear()
+            self._by_name.clear()
+            for character in characters:
+                self._add(character)
+            self.loaded = True
+
+    def add(self, character: Dict[str, Any]):
+        with self._lock:
+            self._remove(character['id'])
+            self._add(character)
+
+    def remove(self, character_id: str):
+        with self._lock:
+            self._remove(character_id)
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        match_all_tags: bool = True,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Tuple[int, List[Tuple[Dict[str, Any], float]]]:
+        """(total matches, page of (character, score)) ranked by name similarity"""
+        with self._lock:
+            candidates = None
+            wanted_tags = [normalize(tag) for tag in tags or [] if normalize(tag)]
+            if wanted_tags:
+                postings = [self._by_tag.get(tag, set()) for tag in wanted_tags]
+                candidates = set.intersection(*postings) if match_all_tags else set.union(*postings)
+
+            if query and normalize(query):
+                scored = self._score_name(query, SEARCH_THRESHOLD)
+                if candidates is not None:
+                    scored = {cid: score for cid, score in scored.items() if cid in candidates}
+            else:
+                ids = candidates if candidates is not None else self._characters.keys()
+                scored = {cid: 1.0 for cid in ids}
+
+            ranked = sorted(
+                scored.items(),
+                key=lambda item: (-item[1], self._characters[item[0]]['name'].casefold())
+            )
+            page = ranked[offset:offset + limit]
+            return len(ranked), [(self._characters[cid], round(score, 4)) for cid, score in page]
+
+    def resolve(self, names: Iterable[str], candidates: int = 3) -> Dict[str, Dict[str, Any]]:
+        """Best stored character for each script character name"""
+        resolved = {}
+        with self._lock:
+            for name in names:
+                scored = sorted(self._score_name(name, SEARCH_THRESHOLD).items(), key=lambda item: -item[1])
+                best = scored[0] if scored and scored[0][1] >= RESOLVE_THRESHOLD else None
+                resolved[name] = {
+                    'character': self._characters[best[0]] if best else None,
+                    'score': round(best[1], 4) if best else 0.0,
+                    'candidates': [
+                        {'character': self._characters[cid], 'score': round(score, 4)}
+                        for cid, score in scored[:candidates]
+                    ],
+                }
+        return resolved
+
+    def _score_name(self, query: str, threshold: float) -> Dict[str, float]:
+        normalized = normalize(query)
+        exact = self._by_name.get(normalized, set())
+        query_grams = trigrams(query)
+
+        # Only characters sharing at least one trigram can clear the threshold
+        candidates = set()
+        for gram in query_grams:
+            candidates.update(self._by_gram.get(gram, ()))
+
+        scores = {}
+        for cid in candidates:
+            # Best of the whole name and each of its words, so "Akira" still
+            # finds "Akira Tanaka" (like pg_trgm's word_similarity)
+            score = max(len(query_grams & grams) / len(query_grams | grams) for grams in self._name_grams[cid])
+            if score >= threshold:
+                scores[cid] = score
+        for cid in exact:
+            scores[cid] = 1.0
+        return scores
+
+    def _add(self, character: Dict[str, Any]):
+        cid = character['id']
+        words = normalize(character['name']).split()
+        grams = trigrams(character['name'])
+        self._characters[cid] = character
+        self._name_grams[cid] = [grams] + ([trigrams(word) for word in words] if len(words) > 1 else [])
+        self._by_name[normalize(character['name'])].add(cid)
+        for gram in grams:
+            self._by_gram[gram].add(cid)
+        for tag in character.get('tags') or []:
+            if normalize(tag):
+                self._by_tag[normalize(tag)].add(cid)
+
+    def _remove(self, cid: str):
+        character = self._characters.pop(cid, None)
+        if character is None:
+            return
+        for gram in trigrams(character['name']):
+            self._discard(self._by_gram, gram, cid)
+        self._name_grams.pop(cid, None)
+        self._discard(self._by_name, normalize(character['name']), cid)
+        for tag in character.get('tags') or []:
+            self._discard(self._by_tag, normalize(tag), cid)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[str]], key: str, cid: str):
+        postings = index.get(key)
+        if postings is not None:
+            postings.discard(cid)
+            if not postings:
+                del index[key]
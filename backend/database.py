@@ -1,6 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from models import Base
+from migrations import run_migrations
 import os
 
 # Get database URL from environment
@@ -11,18 +14,85 @@ if 'mongodb' in DATABASE_URL:
     # If MongoDB URL is provided, use SQLite instead for this implementation
     DATABASE_URL = 'sqlite:///./manga_creator.db'
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
+# Async drivers for the request path; migrations keep using the sync engine
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def _async_url(url: str) -> str:
+    override = os.environ.get('ASYNC_DATABASE_URL')
+    if override:
+        return override
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for database backend '{backend}'")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+# Applied to every new SQLite connection. WAL lets status polls read while a
+# generation job is writing; NORMAL sync is safe in WAL mode and avoids an
+# fsync per commit; busy_timeout makes writers queue instead of failing.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    "synchronous": os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    "busy_timeout": int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    "cache_size": int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000)) * -1,
+    "temp_store": "MEMORY",
+    "mmap_size": int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+}
+
+
+def _engine_options(url: str) -> dict:
+    """Connection and pool settings for the configured backend"""
+    options = {
+        "pool_pre_ping": os.environ.get('DB_POOL_PRE_PING', 'false').lower() == 'true',
+    }
+    parsed = make_url(url)
+
+    if parsed.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if parsed.database in (None, "", ":memory:"):
+            # In-memory databases use a single shared connection; no pool sizing
+            return options
+
+    options.update({
+        "pool_size": int(os.environ.get('DB_POOL_SIZE', 10)),
+        "max_overflow": int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        "pool_timeout": float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    })
+    return options
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+for _engine in (engine, async_engine.sync_engine):
+    if _engine.dialect.name == "sqlite":
+        event.listen(_engine, "connect", _apply_sqlite_pragmas)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay usable after commit; the request path never lazy-loads
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # Create tables
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
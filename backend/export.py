@@ -0,0 +1,167 @@
+import io
+import zipfile
+import logging
+from datetime import datetime
+from typing import Iterable, Iterator, Tuple
+from PIL import Image
+
+from image_store import ImageStore
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# PDF page geometry: panels are fitted onto A4 portrait pages (points)
+PDF_PAGE_WIDTH = 595
+PDF_PAGE_HEIGHT = 842
+PDF_PAGE_MARGIN = 24
+PDF_JPEG_QUALITY = 90
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that hands its bytes out as they arrive"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(store: ImageStore, entries: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """Stream a ZIP archive of (archive name, stored image name) entries.
+
+    The archive is never held in memory: zipfile writes local headers and
+    data descriptors to a non-seekable sink which is drained after every
+    chunk. Images are already compressed, so entries are stored as-is.
+    """
+    sink = _ChunkBuffer()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for arcname, name in entries:
+            try:
+                stored = store.stat(name)
+                if stored is None:
+                    raise FileNotFoundError(name)
+                info = zipfile.ZipInfo(arcname, date_time=datetime.fromtimestamp(stored.mtime).timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with archive.open(info, mode="w", force_zip64=True) as target:
+                    for chunk in store.iter_bytes(name):
+                        target.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            except OSError as e:
+                logger.warning(f"Skipping {arcname} in export: {str(e)}")
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    yield sink.drain()
+
+
+def stream_pdf(store: ImageStore, names: Iterable[str], title: str = "Manga") -> Iterator[bytes]:
+    """Stream a multi-page PDF with one panel per page.
+
+    Objects are written in order and their byte offsets recorded, so only
+    the current page's image plus the cross-reference table (a few bytes
+    per page) is ever held in memory.
+    """
+    offsets = {}
+    position = 0
+    page_ids = []
+
+    def emit(data: bytes) -> bytes:
+        nonlocal position
+        position += len(data)
+        return data
+
+    def obj(number: int, body: bytes) -> bytes:
+        offsets[number] = position
+        return emit(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+    yield emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    # Objects 1 (catalog) and 2 (page tree) are written last, once the page
+    # list is known; page objects start at 3.
+    next_id = 3
+    for name in names:
+        try:
+            jpeg, width, height = _encode_page_image(store, name)
+        except Exception as e:
+            logger.warning(f"Skipping {name} in PDF export: {str(e)}")
+            continue
+
+        image_id, content_id, page_id = next_id, next_id + 1, next_id + 2
+        next_id += 3
+
+        yield obj(image_id, (
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+            b"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n"
+            % (width, height, len(jpeg))
+        ) + jpeg + b"\nendstream")
+
+        draw_w, draw_h, x, y = _fit_on_page(width, height)
+        content = b"q %.2f 0 0 %.2f %.2f %.2f cm /Im0 Do Q" % (draw_w, draw_h, x, y)
+        yield obj(content_id, b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+        yield obj(page_id, (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+            % (PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, image_id, content_id)
+        ))
+        page_ids.append(page_id)
+
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    yield obj(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids)))
+    yield obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    info_id = next_id
+    yield obj(info_id, b"<< /Title (%s) /Producer (Manga Creator) >>" % _pdf_string(title))
+
+    xref_offset = position
+    xref = [b"xref\n0 %d\n" % (info_id + 1), b"0000000000 65535 f \n"]
+    for number in range(1, info_id + 1):
+        # Skipped panels leave no gaps: ids are only allocated on success
+        xref.append(b"%010d 00000 n \n" % offsets[number])
+    yield emit(b"".join(xref))
+    yield emit(
+        b"trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+        % (info_id + 1, info_id, xref_offset)
+    )
+
+
+def _encode_page_image(store: ImageStore, name: str) -> Tuple[bytes, int, int]:
+    """Re-encode a panel as baseline JPEG so the PDF can embed it with DCTDecode"""
+    with store.open(name) as source, Image.open(source) as img:
+        rgb = img.convert("RGB")
+        buffer = io.BytesIO()
+        rgb.save(buffer, format="JPEG", quality=PDF_JPEG_QUALITY)
+        return buffer.getvalue(), rgb.width, rgb.height
+
+
+def _fit_on_page(width: int, height: int) -> Tuple[float, float, float, float]:
+    box_w = PDF_PAGE_WIDTH - 2 * PDF_PAGE_MARGIN
+    box_h = PDF_PAGE_HEIGHT - 2 * PDF_PAGE_MARGIN
+    scale = min(box_w / width, box_h / height)
+    draw_w, draw_h = width * scale, height * scale
+    return draw_w, draw_h, (PDF_PAGE_WIDTH - draw_w) / 2, (PDF_PAGE_HEIGHT - draw_h) / 2
+
+
+def _pdf_string(text: str) -> bytes:
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return escaped.encode("latin-1", errors="replace")
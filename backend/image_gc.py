@@ -0,0 +1,224 @@
+import os
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+
+from image_store import ImageStore, StoredObject, VARIANT_FORMATS
+from models import Panel, Character
+from shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Derived files that can be rebuilt on demand; evicted LRU-first under quota
+CACHE_PREFIXES = ("page_",)
+VARIANT_EXTENSIONS = {ext for ext, _, _ in VARIANT_FORMATS.values()}
+
+
+class ImageGarbageCollector:
+    """Incremental cleanup of the image store.
+
+    Each run deletes files no Panel (or character) references once they are
+    older than a grace period, then evicts cache-only files (composed pages,
+    pre-encoded variants) least-recently-used first until the directory is
+    under quota. Listing and deletes happen in small batches in the
+    threadpool with a pause between batches, so serving never stalls.
+    """
+
+    def __init__(
+        self,
+        store: ImageStore,
+        session_factory,
+        quota_bytes: int = 0,
+        batch_size: int = 500,
+        batch_pause: float = 0.05,
+        grace_seconds: float = 3600,
+        interval_seconds: float = 900,
+        shared_cache: Optional[SharedCache] = None,
+    ):
+        self.store = store
+        self.session_factory = session_factory
+        self.quota_bytes = quota_bytes
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.grace_seconds = grace_seconds
+        self.interval_seconds = interval_seconds
+        self.shared_cache = shared_cache
+        self._lock = asyncio.Lock()
+        self.stats: Dict[str, Any] = {
+            'runs': 0,
+            'files_scanned': 0,
+            'orphans_deleted': 0,
+            'cache_evicted': 0,
+            'reclaimed_bytes': 0,
+            'disk_usage_bytes': None,
+            'last_run_at': None,
+            'last_run_seconds': None,
+            'last_run_reclaimed_bytes': 0,
+        }
+
+    @classmethod
+    def from_env(cls, store: ImageStore, session_factory,
+                 shared_cache: Optional[SharedCache] = None) -> "ImageGarbageCollector":
+        return cls(
+            store,
+            session_factory,
+            quota_bytes=int(os.environ.get('IMAGE_DISK_QUOTA_BYTES', 0)),
+            batch_size=int(os.environ.get('IMAGE_GC_BATCH_SIZE', 500)),
+            batch_pause=float(os.environ.get('IMAGE_GC_BATCH_PAUSE_SECONDS', 0.05)),
+            grace_seconds=float(os.environ.get('IMAGE_GC_GRACE_SECONDS', 3600)),
+            interval_seconds=float(os.environ.get('IMAGE_GC_INTERVAL_SECONDS', 900)),
+            shared_cache=shared_cache,
+        )
+
+    async def run_forever(self, initial_delay: float = 60):
+        await asyncio.sleep(initial_delay)
+        while True:
+            try:
+                # Every worker process runs this loop; one pass per interval is enough
+                if self.shared_cache is None or await run_in_threadpool(
+                    self.shared_cache.add, "lease:image_gc", os.getpid(), ttl=self.interval_seconds * 0.9
+                ):
+                    await self.run_once()
+            except Exception as e:
+                logger.error(f"Image GC run failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """One full incremental pass; concurrent calls wait for the running pass"""
+        async with self._lock:
+            started = time.monotonic()
+            referenced = await self._referenced_names()
+            referenced_stems = {Path(name).stem for name in referenced}
+
+            usage = 0
+            reclaimed = 0
+            cache_entries: List[Tuple[float, int, str]] = []  # (last use, size, key)
+            now = time.time()
+
+            async for batch in self._scan_batches():
+                doomed = []
+                for stored in batch:
+                    self.stats['files_scanned'] += 1
+                    kind = self._classify(stored.name, referenced, referenced_stems)
+                    old_enough = now - stored.mtime > self.grace_seconds
+                    if kind == 'orphan' and old_enough:
+                        doomed.append(stored.key)
+                    else:
+                        usage += stored.size
+                        if kind == 'cache':
+                            cache_entries.append((max(stored.atime, stored.mtime), stored.size, stored.key))
+
+                if doomed:
+                    deleted, freed = await run_in_threadpool(self._delete, doomed, True)
+                    reclaimed += freed
+                    self.stats['orphans_deleted'] += deleted
+                await asyncio.sleep(self.batch_pause)
+
+            if self.quota_bytes and usage > self.quota_bytes:
+                freed = await self._evict(cache_entries, usage - self.quota_bytes)
+                usage -= freed
+                reclaimed += freed
+                if usage > self.quota_bytes:
+                    logger.warning(
+                        f"Image store uses {usage} bytes, over the {self.quota_bytes} byte quota, "
+                        f"and only referenced images remain"
+                    )
+
+            self.stats['runs'] += 1
+            self.stats['reclaimed_bytes'] += reclaimed
+            self.stats['last_run_reclaimed_bytes'] = reclaimed
+            self.stats['disk_usage_bytes'] = usage
+            self.stats['last_run_at'] = now
+            self.stats['last_run_seconds'] = time.monotonic() - started
+            if reclaimed:
+                logger.info(f"Image GC reclaimed {reclaimed} bytes")
+            return dict(self.stats)
+
+    async def _referenced_names(self) -> Set[str]:
+        names: Set[str] = set()
+        async with self.session_factory() as session:
+            result = await session.stream(
+                select(Panel.image_url, Panel.generation_metadata).execution_options(yield_per=1000)
+            )
+            async for image_url, metadata in result:
+                names.add(self.store.name_from_url(image_url))
+                if metadata and metadata.get('raw_image_url'):
+                    names.add(self.store.name_from_url(metadata['raw_image_url']))
+
+            result = await session.stream(select(Character.image_ref).execution_options(yield_per=1000))
+            async for (image_ref,) in result:
+                names.add(self.store.name_from_url(image_ref))
+        names.discard(None)
+        return names
+
+    def _classify(self, name: str, referenced: Set[str], referenced_stems: Set[str]) -> str:
+        """'live' (referenced), 'cache' (rebuildable) or 'orphan'"""
+        if name in referenced:
+            return 'live'
+        if name.startswith(CACHE_PREFIXES):
+            return 'cache'
+        if Path(name).suffix in VARIANT_EXTENSIONS and Path(name).stem in referenced_stems:
+            # Pre-encoded copy of a live image; serving falls back to the original
+            return 'cache'
+        # Unreferenced images, variants of them and abandoned .tmp_ writes
+        return 'orphan'
+
+    async def _scan_batches(self):
+        """Yield stored objects a batch at a time"""
+        iterator = self.store.scan()
+        try:
+            while True:
+                batch = await run_in_threadpool(self._next_batch, iterator)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            await run_in_threadpool(iterator.close)
+
+    def _next_batch(self, iterator) -> List[StoredObject]:
+        batch = []
+        for stored in iterator:
+            batch.append(stored)
+            if len(batch) >= self.batch_size:
+                break
+        return batch
+
+    async def _evict(self, cache_entries: List[Tuple[float, int, str]], needed: int) -> int:
+        cache_entries.sort()  # least recently used first
+        freed = 0
+        i = 0
+        while freed < needed and i < len(cache_entries):
+            batch = []
+            planned = 0
+            while i < len(cache_entries) and len(batch) < self.batch_size and freed + planned < needed:
+                _, size, key = cache_entries[i]
+                batch.append(key)
+                planned += size
+                i += 1
+            deleted, freed_bytes = await run_in_threadpool(self._delete, batch, False)
+            freed += freed_bytes
+            self.stats['cache_evicted'] += deleted
+            await asyncio.sleep(self.batch_pause)
+        return freed
+
+    def _delete(self, keys: List[str], check_grace: bool) -> Tuple[int, int]:
+        """Remove objects by key; returns (objects deleted, bytes freed)"""
+        deleted = 0
+        freed = 0
+        # Re-checked at delete time: a dedup hit in ImageStore.save touches the object
+        cutoff = time.time() - self.grace_seconds if check_grace else None
+        for key in keys:
+            try:
+                size = self.store.remove(key, modified_before=cutoff)
+            except Exception as e:
+                logger.warning(f"Image GC could not delete {key}: {str(e)}")
+                continue
+            if size is not None:
+                deleted += 1
+                freed += size
+        return deleted, freed
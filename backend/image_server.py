@@ -0,0 +1,226 @@
+import hashlib
+import logging
+from email.utils import formatdate, parsedate
+from mimetypes import guess_type
+from typing import Optional, Tuple
+
+import anyio
+from starlette._utils import get_route_path
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, FileResponse
+from starlette.types import Scope, Receive, Send
+
+from image_store import ImageStore, StoredObject, VARIANT_FORMATS, get_image_store
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Legacy names (e.g. fallback_<scene id>.png) were overwritten in place
+MUTABLE_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+
+
+class RangeFileResponse(Response):
+    """Stream a single byte range of a file"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, start: int, end: int, size: int, headers: dict, media_type: str):
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; close the body rather than hang
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class StoredObjectResponse(Response):
+    """Proxy an object (or one byte range of it) from a remote image store"""
+
+    def __init__(self, store: ImageStore, name: str, headers: dict, media_type: str, byte_range: Optional[Tuple[int, int]] = None, size: int = 0):
+        super().__init__(status_code=206 if byte_range else 200, headers=headers, media_type=media_type)
+        self.store = store
+        self.name = name
+        self.byte_range = byte_range
+        if byte_range:
+            start, end = byte_range
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        start, end = self.byte_range or (0, None)
+        chunks = await anyio.to_thread.run_sync(self.store.iter_bytes, self.name, start, end)
+        try:
+            while True:
+                chunk = await anyio.to_thread.run_sync(next, chunks, None)
+                if chunk is None:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            await anyio.to_thread.run_sync(chunks.close)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class ImmutableImageFiles:
+    """ASGI app serving generated images with long-lived cache headers.
+
+    Content-hashed names never change meaning, so they are served with
+    `Cache-Control: immutable` and a strong ETag derived from the hash.
+    Single byte ranges and pre-encoded variants (negotiated via Accept)
+    are supported.
+    """
+
+    def __init__(self, store: Optional[ImageStore] = None):
+        # Resolved on the first request when not given, so mounting is free
+        self._store = store
+
+    @property
+    def store(self) -> ImageStore:
+        if self._store is None:
+            self._store = get_image_store()
+        return self._store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        assert scope["type"] == "http"
+        response = await self.get_response(scope)
+        await response(scope, receive, send)
+
+    async def get_response(self, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+
+        name = get_route_path(scope).lstrip("/")
+        if not name or "/" in name or "\\" in name or name.startswith("."):
+            raise HTTPException(status_code=404)
+
+        request_headers = Headers(scope=scope)
+        stored, media_type, variant = await anyio.to_thread.run_sync(self._select_object, name, request_headers)
+        if stored is None:
+            raise HTTPException(status_code=404)
+
+        headers = self._cache_headers(name, stored, variant)
+        if VARIANT_FORMATS:
+            headers["vary"] = "Accept"
+
+        if self._is_not_modified(headers, request_headers):
+            return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "content-length"})
+
+        byte_range = self._parse_range(request_headers, headers, stored.size)
+        if byte_range == "unsatisfiable":
+            return Response(status_code=416, headers={"content-range": f"bytes */{stored.size}"})
+
+        # Local backends hand the file to the server (sendfile where possible);
+        # object stores are proxied so clients only ever see /images URLs
+        path = self.store.local_path(stored.name)
+        if path is None:
+            return StoredObjectResponse(self.store, stored.name, headers, media_type, byte_range, stored.size)
+        if byte_range is not None:
+            start, end = byte_range
+            return RangeFileResponse(str(path), start, end, stored.size, headers, media_type)
+        return FileResponse(str(path), headers=headers, media_type=media_type)
+
+    def _select_object(self, name: str, request_headers: Headers) -> Tuple[Optional[StoredObject], Optional[str], Optional[str]]:
+        """Pick the original image or the best pre-encoded variant the client accepts"""
+        accept = request_headers.get("accept", "")
+        for variant_type in VARIANT_FORMATS:
+            if variant_type in accept:
+                variant_name = self.store.variant_name(name, variant_type)
+                stored = self.store.stat(variant_name) if variant_name and variant_name != name else None
+                if stored is not None:
+                    return stored, variant_type, variant_type
+
+        stored = self.store.stat(name)
+        if stored is None:
+            return None, None, None
+        return stored, guess_type(name)[0] or "application/octet-stream", None
+
+    def _cache_headers(self, name: str, stored: StoredObject, variant: Optional[str]) -> dict:
+        digest = self.store.content_digest(name)
+        if digest is not None:
+            suffix = f"-{VARIANT_FORMATS[variant][0].lstrip('.')}" if variant else ""
+            etag = f'"{digest}{suffix}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            etag_base = f"{stored.mtime}-{stored.size}-{variant or ''}"
+            etag = f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+            cache_control = MUTABLE_CACHE_CONTROL
+
+        return {
+            "etag": etag,
+            "cache-control": cache_control,
+            "last-modified": formatdate(stored.mtime, usegmt=True),
+            "accept-ranges": "bytes",
+            "content-length": str(stored.size),
+        }
+
+    @staticmethod
+    def _is_not_modified(response_headers: dict, request_headers: Headers) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or response_headers["etag"] in tags
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is not None:
+            since = parsedate(if_modified_since)
+            last_modified = parsedate(response_headers["last-modified"])
+            return since is not None and last_modified is not None and since >= last_modified
+        return False
+
+    @staticmethod
+    def _parse_range(request_headers: Headers, response_headers: dict, size: int):
+        """Return (start, end) for a single satisfiable range, None to send the whole file"""
+        range_header = request_headers.get("range")
+        if not range_header or not range_header.startswith("bytes="):
+            return None
+
+        # A stale If-Range validator means the client's partial copy is useless
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range.strip() not in (response_headers["etag"], response_headers["last-modified"]):
+            return None
+
+        ranges = range_header[len("bytes="):].split(",")
+        if len(ranges) != 1:
+            # Multipart byteranges aren't worth it for images; send everything
+            return None
+
+        first, _, last = ranges[0].strip().partition("-")
+        try:
+            if first == "":
+                suffix = int(last)
+                if suffix <= 0:
+                    return "unsatisfiable"
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+        except ValueError:
+            return None
+
+        if start >= size or start > end:
+            return "unsatisfiable"
+        return start, min(end, size - 1)
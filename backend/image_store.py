@@ -0,0 +1,467 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import logging
+from mimetypes import guess_type
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+from PIL import Image
+
+from metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# Names produced by ImageStore.save: <prefix>_<32 hex chars of sha256>.<ext>
+HASHED_NAME_PATTERN = re.compile(r'^[a-z]+_([0-9a-f]{32})\.[a-z0-9]+$')
+
+# Smaller encodings written next to each image and picked by Accept header
+VARIANT_FORMATS = {
+    "image/webp": (".webp", "WEBP", {"quality": 90, "method": 4}),
+}
+
+CHUNK_SIZE = 64 * 1024
+# Streamed uploads are hashed before they get a name; bigger ones spill to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+class StoredObject(NamedTuple):
+    name: str
+    key: str  # backend location, e.g. "ab/cd/<name>" or an S3 object key
+    size: int
+    mtime: float
+    atime: float
+
+
+class ImageStore:
+    """Content-addressed storage for generated images.
+
+    Naming, URLs and variants live here; subclasses only move bytes. Objects
+    are spread over hash-prefix shards (ab/cd/<name>) so no single directory
+    or key prefix grows without bound.
+    """
+
+    def __init__(self, url_prefix: str = "/images", shard_depth: int = 2):
+        self.url_prefix = url_prefix
+        self.shard_depth = shard_depth
+
+    def save(self, data: bytes, prefix: str = "panel", ext: str = ".png") -> str:
+        """Store image bytes under a name derived from their content; returns the name"""
+        name = f"{prefix}_{hashlib.sha256(data).hexdigest()[:32]}{ext}"
+
+        # Identical content already stored: the name is its own proof.
+        # Touch it so garbage collection treats it as freshly written.
+        stored = self._touch(name)
+        record_cache("image_store", stored)
+        if not stored:
+            self._put(name, data)
+            self._write_variants(name, io.BytesIO(data), len(data))
+        return name
+
+    def save_stream(self, source: BinaryIO, prefix: str = "panel", ext: str = ".png") -> str:
+        """Store a file-like object without holding all of it in memory"""
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                spool.write(chunk)
+                size += len(chunk)
+
+            name = f"{prefix}_{digest.hexdigest()[:32]}{ext}"
+            stored = self._touch(name)
+            record_cache("image_store", stored)
+            if not stored:
+                # Variants first: S3's upload_fileobj closes the file it is given
+                spool.seek(0)
+                self._write_variants(name, spool, size)
+                spool.seek(0)
+                self._put_stream(name, spool)
+        return name
+
+    def save_image(self, img: Image.Image, prefix: str = "panel", format: str = "PNG") -> str:
+        """Encode a PIL image and store it content-addressed"""
+        buffer = io.BytesIO()
+        img.save(buffer, format=format)
+        return self.save(buffer.getvalue(), prefix, f".{format.lower()}")
+
+    def url_for(self, name: str) -> str:
+        """Public URL for a stored image name (or legacy path)"""
+        return f"{self.url_prefix}/{Path(name).name}"
+
+    def name_from_url(self, url: str) -> Optional[str]:
+        """Image name referenced by a public URL, if it points at this store"""
+        if not url or not url.startswith(self.url_prefix + "/"):
+            return None
+        name = url[len(self.url_prefix) + 1:]
+        if not name or "/" in name or name in (".", ".."):
+            return None
+        return name
+
+    def shard_for(self, name: str) -> str:
+        """Hash-prefix directory of a name, e.g. "3f/a9" """
+        digest = self.content_digest(name) or hashlib.sha256(name.encode('utf-8')).hexdigest()
+        return "/".join(digest[2 * i:2 * i + 2] for i in range(self.shard_depth))
+
+    def variant_name(self, name: str, media_type: str) -> Optional[str]:
+        """Name of a pre-encoded variant of an image, if one is configured"""
+        if media_type not in VARIANT_FORMATS:
+            return None
+        return Path(name).stem + VARIANT_FORMATS[media_type][0]
+
+    @staticmethod
+    def content_digest(name: str) -> Optional[str]:
+        """Content hash embedded in a stored name, None for legacy names"""
+        match = HASHED_NAME_PATTERN.match(name)
+        return match.group(1) if match else None
+
+    def iter_bytes(self, name: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Stream an image, or the inclusive byte range start..end of it"""
+        raise NotImplementedError
+
+    def open(self, name: str) -> BinaryIO:
+        """Seekable binary file object; raises FileNotFoundError"""
+        raise NotImplementedError
+
+    def stat(self, name: str) -> Optional[StoredObject]:
+        raise NotImplementedError
+
+    def local_path(self, name: str) -> Optional[Path]:
+        """Filesystem path when the backend is local, for sendfile and friends"""
+        return None
+
+    def scan(self) -> Iterator[StoredObject]:
+        """Every stored object, including abandoned temp uploads"""
+        raise NotImplementedError
+
+    def remove(self, key: str, modified_before: Optional[float] = None) -> Optional[int]:
+        """Delete an object by key; returns bytes freed, None if missing or too new"""
+        raise NotImplementedError
+
+    def _touch(self, name: str) -> bool:
+        """Refresh an existing object's mtime; False if it isn't stored"""
+        raise NotImplementedError
+
+    def _put(self, name: str, data: bytes):
+        self._put_stream(name, io.BytesIO(data))
+
+    def _put_stream(self, name: str, source: BinaryIO):
+        raise NotImplementedError
+
+    def _write_variants(self, name: str, source: BinaryIO, size: int):
+        """Pre-encode smaller variants so serving never has to transcode"""
+        try:
+            img = Image.open(source)
+            img.load()
+        except Exception as e:
+            logger.warning(f"Cannot decode {name} for variants: {str(e)}")
+            return
+
+        for media_type, (_, format, params) in VARIANT_FORMATS.items():
+            buffer = io.BytesIO()
+            try:
+                img.save(buffer, format=format, **params)
+            except Exception as e:
+                logger.warning(f"Cannot encode {media_type} variant of {name}: {str(e)}")
+                continue
+            # Only keep variants that actually save bytes on the wire
+            if buffer.tell() < size:
+                self._put(self.variant_name(name, media_type), buffer.getvalue())
+
+
+class LocalImageStore(ImageStore):
+    """Images on a local (or shared) filesystem under root/ab/cd/<name>.
+
+    Files from the old flat layout are still found at root/<name> until
+    migrate_flat_layout moves them into their shards.
+    """
+
+    def __init__(self, root: str = "./generated_images", url_prefix: str = "/images", shard_depth: int = 2):
+        super().__init__(url_prefix, shard_depth)
+        # Created by the first write, not here: constructing a store has no side effects
+        self.root = Path(root)
+
+    def path_for(self, name: str) -> Path:
+        """Sharded location of a name, whether or not it exists yet"""
+        return self.root / self.shard_for(name) / name
+
+    def local_path(self, name: str) -> Optional[Path]:
+        sharded = self.path_for(name)
+        # Checked twice so a concurrent migration move can't hide the file
+        for path in (sharded, self.root / name, sharded):
+            if path.is_file():
+                return path
+        return None
+
+    def iter_bytes(self, name: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with self.open(name) as source:
+            source.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = source.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def open(self, name: str) -> BinaryIO:
+        path = self.local_path(name)
+        if path is None:
+            raise FileNotFoundError(name)
+        return open(path, 'rb')
+
+    def stat(self, name: str) -> Optional[StoredObject]:
+        path = self.local_path(name)
+        if path is None:
+            return None
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        return StoredObject(name, path.relative_to(self.root).as_posix(), st.st_size, st.st_mtime, st.st_atime)
+
+    def scan(self) -> Iterator[StoredObject]:
+        pending = [self.root]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(Path(entry.path))
+                                continue
+                            if not entry.is_file(follow_symlinks=False):
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        key = Path(entry.path).relative_to(self.root).as_posix()
+                        yield StoredObject(entry.name, key, st.st_size, st.st_mtime, st.st_atime)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Cannot scan {directory}: {str(e)}")
+
+    def remove(self, key: str, modified_before: Optional[float] = None) -> Optional[int]:
+        path = self.root / key
+        try:
+            st = path.stat()
+            if modified_before is not None and st.st_mtime > modified_before:
+                return None
+            path.unlink()
+        except FileNotFoundError:
+            return None
+        return st.st_size
+
+    def migrate_flat_layout(self) -> int:
+        """Move files from the old flat directory into their shards"""
+        moved = 0
+        try:
+            with os.scandir(self.root) as entries:
+                names = [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if name.startswith(".tmp_"):
+                continue
+            target = self.path_for(name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(self.root / name, target)
+                moved += 1
+            except FileNotFoundError:
+                continue
+        if moved:
+            logger.info(f"Moved {moved} images into sharded directories")
+        return moved
+
+    def _touch(self, name: str) -> bool:
+        path = self.local_path(name)
+        if path is None:
+            return False
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _put_stream(self, name: str, source: BinaryIO):
+        path = self.path_for(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp_")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+class S3ImageStore(ImageStore):
+    """Images in an S3-compatible bucket (AWS, MinIO, Ceph, ...).
+
+    Any node holding the same bucket settings can write and serve images,
+    so API and generation workers no longer need a shared filesystem.
+    Large uploads go through boto3's multipart transfer manager.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region_name: Optional[str] = None,
+        url_prefix: str = "/images",
+        shard_depth: int = 2,
+        multipart_threshold: int = 8 * 1024 * 1024,
+    ):
+        super().__init__(url_prefix, shard_depth)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self.multipart_threshold = multipart_threshold
+        self._client = None
+        self._client_pid = None
+
+    @property
+    def client(self):
+        # boto3 clients must not cross a fork, so worker processes build their own
+        if self._client is None or self._client_pid != os.getpid():
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("S3 image storage requires boto3 (pip install boto3)")
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url, region_name=self.region_name)
+            self._client_pid = os.getpid()
+        return self._client
+
+    def key_for(self, name: str) -> str:
+        return f"{self.prefix}{self.shard_for(name)}/{name}"
+
+    def iter_bytes(self, name: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        params = {"Bucket": self.bucket, "Key": self.key_for(name)}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            body = self.client.get_object(**params)["Body"]
+        except Exception as e:
+            if _is_missing(e):
+                raise FileNotFoundError(name)
+            raise
+        try:
+            yield from body.iter_chunks(CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def open(self, name: str) -> BinaryIO:
+        # PIL needs to seek; images are small enough to buffer whole
+        return io.BytesIO(b"".join(self.iter_bytes(name)))
+
+    def stat(self, name: str) -> Optional[StoredObject]:
+        key = self.key_for(name)
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            if _is_missing(e):
+                return None
+            raise
+        mtime = head["LastModified"].timestamp()
+        return StoredObject(name, key, head["ContentLength"], mtime, mtime)
+
+    def scan(self) -> Iterator[StoredObject]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                mtime = item["LastModified"].timestamp()
+                yield StoredObject(item["Key"].rsplit("/", 1)[-1], item["Key"], item["Size"], mtime, mtime)
+
+    def remove(self, key: str, modified_before: Optional[float] = None) -> Optional[int]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            if _is_missing(e):
+                return None
+            raise
+        if modified_before is not None and head["LastModified"].timestamp() > modified_before:
+            return None
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return head["ContentLength"]
+
+    def _touch(self, name: str) -> bool:
+        key = self.key_for(name)
+        try:
+            # Copying an object onto itself is the only way to bump LastModified
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=key,
+                CopySource={"Bucket": self.bucket, "Key": key},
+                MetadataDirective="REPLACE",
+                ContentType=_content_type(name),
+            )
+        except Exception as e:
+            if _is_missing(e):
+                return False
+            raise
+        return True
+
+    def _put(self, name: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self.key_for(name), Body=data, ContentType=_content_type(name))
+
+    def _put_stream(self, name: str, source: BinaryIO):
+        from boto3.s3.transfer import TransferConfig
+
+        config = TransferConfig(multipart_threshold=self.multipart_threshold, multipart_chunksize=self.multipart_threshold)
+        self.client.upload_fileobj(
+            source, self.bucket, self.key_for(name),
+            ExtraArgs={"ContentType": _content_type(name)}, Config=config
+        )
+
+
+def _content_type(name: str) -> str:
+    return guess_type(name)[0] or "application/octet-stream"
+
+
+def _is_missing(error: Exception) -> bool:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+def image_store_from_env() -> ImageStore:
+    """Build the store described by IMAGE_STORAGE_* / S3_* environment variables"""
+    backend = os.environ.get('IMAGE_STORAGE_BACKEND', 'local').lower()
+    shard_depth = int(os.environ.get('IMAGE_STORAGE_SHARD_DEPTH', 2))
+
+    if backend == 'local':
+        return LocalImageStore(os.environ.get('IMAGE_STORAGE_ROOT', './generated_images'), shard_depth=shard_depth)
+    if backend == 's3':
+        bucket = os.environ.get('S3_BUCKET')
+        if not bucket:
+            raise RuntimeError("IMAGE_STORAGE_BACKEND=s3 requires S3_BUCKET")
+        return S3ImageStore(
+            bucket,
+            prefix=os.environ.get('S3_PREFIX', ''),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            region_name=os.environ.get('S3_REGION') or None,
+            shard_depth=shard_depth,
+            multipart_threshold=int(os.environ.get('S3_MULTIPART_THRESHOLD_BYTES', 8 * 1024 * 1024)),
+        )
+    raise RuntimeError(f"Unknown IMAGE_STORAGE_BACKEND '{backend}'")
+
+
+_default_store: Optional[ImageStore] = None
+
+
+def get_image_store() -> ImageStore:
+    """The process-wide store; worker processes build the same one from env"""
+    global _default_store
+    if _default_store is None:
+        _default_store = image_store_from_env()
+    return _default_store
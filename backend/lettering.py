@@ -0,0 +1,152 @@
+import os
+import logging
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple, Union
+from PIL import Image, ImageDraw, ImageFont
+
+from image_store import get_image_store
+
+logger = logging.getLogger(__name__)
+
+# Optional TTF/OTF used for lettering; Pillow's bundled font otherwise
+LETTERING_FONT = os.environ.get('LETTERING_FONT')
+FONT_SIZE_RATIO = 0.045  # font size relative to panel width
+BUBBLE_MAX_WIDTH_RATIO = 0.42
+BUBBLE_PADDING = 0.35  # padding relative to font size
+BUBBLE_OUTLINE = 3
+MAX_LINES_PER_BUBBLE = 6
+# Bubble sizes are rounded up to this step so masks get reused across panels
+BUBBLE_SIZE_STEP = 8
+# Bubble shapes are drawn this many times larger, then downsampled (anti-aliasing)
+MASK_SUPERSAMPLE = 3
+
+
+@lru_cache(maxsize=32)
+def get_font(size: int) -> ImageFont.FreeTypeFont:
+    """Font instance per size, shared by every panel a worker letters"""
+    if LETTERING_FONT:
+        try:
+            return ImageFont.truetype(LETTERING_FONT, size)
+        except OSError as e:
+            logger.warning(f"Cannot load lettering font {LETTERING_FONT}: {str(e)}")
+    return ImageFont.load_default(size=size)
+
+
+@lru_cache(maxsize=4096)
+def glyph_width(char: str, size: int) -> float:
+    """Advance width of a single glyph"""
+    return get_font(size).getlength(char)
+
+
+@lru_cache(maxsize=8192)
+def layout_line(text: str, size: int, max_width: int) -> Tuple[Tuple[str, ...], int]:
+    """Word-wrap one dialogue line; returns (wrapped lines, widest line width)"""
+    space = glyph_width(" ", size)
+    lines = []
+    current = []
+    current_width = 0.0
+    widest = 0.0
+
+    for word in text.split():
+        word_width = sum(glyph_width(c, size) for c in word)
+        needed = word_width if not current else current_width + space + word_width
+        if current and needed > max_width:
+            lines.append(" ".join(current))
+            widest = max(widest, current_width)
+            current, current_width = [word], word_width
+        else:
+            current.append(word)
+            current_width = needed
+    if current:
+        lines.append(" ".join(current))
+        widest = max(widest, current_width)
+
+    if len(lines) > MAX_LINES_PER_BUBBLE:
+        lines = lines[:MAX_LINES_PER_BUBBLE]
+        lines[-1] = lines[-1].rstrip(".") + "..."
+    return tuple(lines), int(widest)
+
+
+@lru_cache(maxsize=256)
+def bubble_masks(width: int, height: int, tail: str) -> Tuple[Image.Image, Image.Image]:
+    """Fill and outline masks for a bubble of this size (tail: 'left' or 'right').
+
+    The returned images are shared between calls and must not be modified.
+    """
+    tail_height = max(height // 4, 8)
+    scale = MASK_SUPERSAMPLE
+    w, h, th = width * scale, (height + tail_height) * scale, tail_height * scale
+    outline = BUBBLE_OUTLINE * scale
+
+    def draw_shape(draw: ImageDraw.ImageDraw, inset: int):
+        draw.ellipse((inset, inset, w - 1 - inset, h - th - 1 - inset), fill=255)
+        base_x = w * (0.3 if tail == 'left' else 0.7)
+        tip_x = w * (0.18 if tail == 'left' else 0.82)
+        draw.polygon([
+            (base_x - w * 0.06 + inset, h - th - h * 0.08),
+            (base_x + w * 0.06 - inset, h - th - h * 0.08),
+            (tip_x, h - 1 - inset),
+        ], fill=255)
+
+    outer = Image.new("L", (w, h), 0)
+    draw_shape(ImageDraw.Draw(outer), 0)
+    inner = Image.new("L", (w, h), 0)
+    draw_shape(ImageDraw.Draw(inner), outline)
+
+    size = (width, height + tail_height)
+    return inner.resize(size, Image.LANCZOS), outer.resize(size, Image.LANCZOS)
+
+
+def letter_panel(source_name: str, dialogue: List[Union[str, Dict[str, Any]]]) -> str:
+    """Draw speech bubbles for each dialogue line and store the result.
+
+    Runs inside a worker process; returns the lettered image URL.
+    """
+    store = get_image_store()
+    with store.open(source_name) as source, Image.open(source) as img:
+        panel = img.convert("RGB")
+
+    font_size = max(int(panel.width * FONT_SIZE_RATIO), 10)
+    font = get_font(font_size)
+    padding = int(font_size * BUBBLE_PADDING)
+    line_height = int(font_size * 1.25)
+    max_text_width = int(panel.width * BUBBLE_MAX_WIDTH_RATIO)
+    margin = max(panel.width // 40, 4)
+
+    draw = ImageDraw.Draw(panel)
+
+    y = margin
+    for i, line in enumerate(dialogue):
+        text = line.get('text', '') if isinstance(line, dict) else str(line)
+        if not text.strip():
+            continue
+
+        lines, text_width = layout_line(text.strip(), font_size, max_text_width)
+        # An ellipse inscribing a rectangle needs ~sqrt(2) times its size
+        bubble_w = _round_up(int((text_width + 2 * padding) * 1.42))
+        bubble_h = _round_up(int((len(lines) * line_height + 2 * padding) * 1.42))
+        tail = 'left' if i % 2 == 0 else 'right'
+        fill_mask, outline_mask = bubble_masks(bubble_w, bubble_h, tail)
+
+        if y + outline_mask.height > panel.height - margin:
+            logger.warning(f"Dialogue overflow on {source_name}, {len(dialogue) - i} lines dropped")
+            break
+        x = margin if tail == 'left' else panel.width - margin - bubble_w
+
+        box = (x, y, x + outline_mask.width, y + outline_mask.height)
+        panel.paste((0, 0, 0), box, outline_mask)
+        panel.paste((255, 255, 255), box, fill_mask)
+
+        text_y = y + (bubble_h - len(lines) * line_height) // 2
+        for wrapped in lines:
+            line_width = font.getlength(wrapped)
+            draw.text((x + (bubble_w - line_width) / 2, text_y), wrapped, font=font, fill=(0, 0, 0))
+            text_y += line_height
+
+        y += outline_mask.height + margin // 2
+
+    return store.url_for(store.save_image(panel, prefix="lettered"))
+
+
+def _round_up(value: int) -> int:
+    return -(-value // BUBBLE_SIZE_STEP) * BUBBLE_SIZE_STEP
@@ -0,0 +1,170 @@
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from starlette.responses import Response
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+# Origin for startup timings: when the app's modules started loading
+PROCESS_STARTED = time.perf_counter()
+
+# Set (by serve.py) when several worker processes serve the API: each one
+# writes its samples to files there and /metrics aggregates all of them.
+# Gauges say how; "live" modes drop the values of exited processes.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Pipeline stages, from script parsing to the per-panel commit
+STAGES = (
+    "parse_script",
+    "build_prompt",
+    "encode_reference",
+    "sd_health_check",
+    "sd_generate",
+    "save_image",
+    "letter_panel",
+    "panel_commit",
+)
+
+STAGE_SECONDS = Histogram(
+    "manga_stage_seconds",
+    "Time spent in each generation pipeline stage",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+FALLBACK_IMAGES = Counter(
+    "manga_fallback_images_total",
+    "Placeholder images produced instead of Stable Diffusion output",
+    ["reason"],
+)
+SD_ERRORS = Counter("manga_sd_errors_total", "Failed panel generations")
+CACHE_LOOKUPS = Counter("manga_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+GENERATIONS_IN_FLIGHT = Gauge(
+    "manga_generations_in_flight", "Panels being generated right now", multiprocess_mode="livesum"
+)
+JOBS_QUEUED = Gauge("manga_jobs_queued", "Manga jobs accepted but not started yet", multiprocess_mode="livesum")
+PANELS_QUEUED = Gauge(
+    "manga_panels_queued", "Panels of running jobs not generated yet", multiprocess_mode="livesum"
+)
+STARTUP_SECONDS = Gauge(
+    "manga_startup_seconds",
+    "Startup phase durations (import, schema, startup, warmup, first_request); slowest worker",
+    ["phase"],
+    multiprocess_mode="livemax",
+)
+ADMISSION_REJECTIONS = Counter(
+    "manga_admission_rejections_total",
+    "Generation requests shed by admission control",
+    ["endpoint", "reason"],
+)
+PANEL_BUDGET_USED = Gauge(
+    "manga_panel_budget_used", "Panels admitted and not generated yet", multiprocess_mode="livesum"
+)
+COALESCED_CALLS = Counter(
+    "manga_coalesced_calls_total",
+    "Calls that waited for an identical in-flight call instead of repeating it",
+    ["operation"],
+)
+COALESCED_SECONDS_SAVED = Counter(
+    "manga_coalesced_seconds_saved_total",
+    "Work time not spent thanks to coalescing (leader duration per waiter)",
+    ["operation"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "manga_http_request_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+
+# Label children resolved once; .labels() on every call costs a lock and a dict lookup
+_stage_timers = {stage: STAGE_SECONDS.labels(stage) for stage in STAGES}
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a block as one pipeline stage"""
+    histogram = _stage_timers[stage]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+def timed_stage(stage: str):
+    """Decorator timing every call of a function as a pipeline stage"""
+    histogram = _stage_timers[stage]
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class RequestLatencyMiddleware:
+    """Times every HTTP request, labelled by the route template that matched.
+
+    Templates (`/api/scripts/{script_id}`) keep label cardinality bounded;
+    requests no route matched are grouped under "unmatched".
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._first_request = True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        if self._first_request:
+            self._first_request = False
+            STARTUP_SECONDS.labels("first_request").set(start - PROCESS_STARTED)
+        root_path = scope.get("root_path", "")
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router records the matched route (or mount) in the shared scope
+            route = scope.get("route")
+            if route is not None:
+                template = route.path
+            elif scope.get("root_path", "") != root_path:
+                template = scope["root_path"] + "/{path}"
+            else:
+                template = "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], template, str(status)).observe(time.perf_counter() - start)
+
+
+def metrics_response() -> Response:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_worker_exited():
+    """Drop this process's live gauges from the aggregate (multiprocess mode)"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,211 @@
+import json
+import logging
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import Column, Integer, String, DateTime, MetaData, Table, select, insert, inspect, text, bindparam, LargeBinary
+from sqlalchemy.engine import Connection, Engine
+
+from models import Base, JobPanel, compress_value, decompress_value
+from script_search import create_search_index
+
+logger = logging.getLogger(__name__)
+
+# Kept outside Base so it is never part of the application schema
+_version_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+
+def _create_indexes(conn: Connection, names: List[str]):
+    """Create model indexes that tables created before they existed are missing"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+
+
+def _add_lookup_indexes(conn: Connection):
+    _create_indexes(conn, [
+        "ix_scripts_created_at",
+        "ix_characters_created_at",
+        "ix_scenes_script_id_order",
+        "ix_panels_scene_id_created_at",
+        "ix_generation_jobs_script_id_created_at",
+    ])
+
+
+def _add_missing_columns(conn: Connection, table: str, columns: List[Tuple[str, str]]):
+    existing = {column['name'] for column in inspect(conn).get_columns(table)}
+    for name, ddl_type in columns:
+        if name not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN "{name}" {ddl_type}'))
+
+
+def _recompress(conn: Connection, table: str, column: str, to_bytes: Callable[[str], bytes]):
+    """Rewrite plain-text values of a column in the compressed format"""
+    column_types = {c['name']: c['type'] for c in inspect(conn).get_columns(table)}
+    if conn.dialect.name == "postgresql" and not isinstance(column_types[column], LargeBinary):
+        conn.execute(text(
+            f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BYTEA USING convert_to({column}::text, \'UTF8\')'
+        ))
+    rows = conn.execute(text(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")).all()
+    update = text(f"UPDATE {table} SET {column} = :value WHERE id = :id").bindparams(
+        bindparam("value", type_=LargeBinary)
+    )
+    for row_id, value in rows:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = bytes(value)
+            if value[:1] in (b"\x00", b"\x01"):
+                continue
+            value = value.decode('utf-8')
+        conn.execute(update, {"id": row_id, "value": to_bytes(value)})
+
+
+def _store_scripts_compactly(conn: Connection):
+    """Move parsed structure into Scene rows and compress large columns"""
+    _add_missing_columns(conn, "scenes", [("actions", "JSON"), ("time", "VARCHAR")])
+
+    script_columns = {column['name'] for column in inspect(conn).get_columns("scripts")}
+    if "parsed_data" in script_columns:
+        # Backfill what Scene rows did not keep: time, individual actions, speakers
+        update_scene = text(
+            'UPDATE scenes SET time = :time, actions = :actions, dialogue = :dialogue '
+            'WHERE script_id = :script_id AND "order" = :order'
+        )
+        rows = conn.execute(text("SELECT id, parsed_data FROM scripts WHERE parsed_data IS NOT NULL")).all()
+        for script_id, parsed_data in rows:
+            if isinstance(parsed_data, str):
+                parsed_data = json.loads(parsed_data)
+            for scene in (parsed_data or {}).get('scenes', []):
+                conn.execute(update_scene, {
+                    "script_id": script_id,
+                    "order": scene['order'],
+                    "time": scene.get('time'),
+                    "actions": json.dumps(scene.get('actions', [])),
+                    "dialogue": json.dumps(scene.get('dialogue', [])),
+                })
+
+        if conn.dialect.name != "sqlite" or sqlite3.sqlite_version_info >= (3, 35, 0):
+            conn.execute(text("ALTER TABLE scripts DROP COLUMN parsed_data"))
+        else:
+            conn.execute(text("UPDATE scripts SET parsed_data = NULL"))
+
+    _recompress(conn, "scripts", "content", lambda value: compress_value(value.encode('utf-8')))
+    _recompress(conn, "generation_jobs", "result_data", lambda value: compress_value(
+        json.dumps(json.loads(value), separators=(',', ':')).encode('utf-8')
+    ))
+
+
+def _add_panel_fingerprints(conn: Connection):
+    # Existing panels stay unfingerprinted: they are never reused, only replaced
+    _add_missing_columns(conn, "panels", [("fingerprint", "VARCHAR")])
+
+
+def _legacy_panel_ids(entries: List[Dict[str, Any]], panels: Dict[Tuple[str, str], List[str]],
+                      known: Set[str], claimed: Set[str]) -> Optional[List[str]]:
+    """Panel ids for a job's old panel summaries, or None if any can't be found.
+
+    The oldest summaries were written before the panel was flushed, so their
+    panel_id is null: they are matched to the oldest unclaimed panel with the
+    same scene and image instead (jobs are visited oldest first).
+    """
+    panel_ids = []
+    for entry in entries:
+        panel_id = entry.get('panel_id')
+        if panel_id not in known or panel_id in claimed or panel_id in panel_ids:
+            key = (entry.get('scene_id'), entry.get('image_url'))
+            panel_id = next(
+                (pid for pid in panels.get(key, []) if pid not in claimed and pid not in panel_ids), None
+            )
+            if panel_id is None:
+                return None
+        panel_ids.append(panel_id)
+    return panel_ids
+
+
+def _move_job_panels_to_rows(conn: Connection):
+    """Turn panel lists kept in generation_jobs.result_data into job_panels rows"""
+    JobPanel.__table__.create(conn, checkfirst=True)
+    update = text("UPDATE generation_jobs SET result_data = :value WHERE id = :id").bindparams(
+        bindparam("value", type_=LargeBinary)
+    )
+
+    panels: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+    for panel_id, scene_id, image_url in conn.execute(
+        text("SELECT id, scene_id, image_url FROM panels ORDER BY created_at, id")
+    ):
+        panels[(scene_id, image_url)].append(panel_id)
+    known = {panel_id for ids in panels.values() for panel_id in ids}
+    claimed: Set[str] = set()
+
+    rows = conn.execute(text(
+        "SELECT id, result_data FROM generation_jobs WHERE result_data IS NOT NULL ORDER BY created_at, id"
+    )).all()
+    for job_id, value in rows:
+        result_data = json.loads(decompress_value(value))
+        if not isinstance(result_data, dict):
+            continue
+        # Newer jobs kept ids; the oldest kept full panel summaries
+        panel_ids = result_data.get('panel_ids')
+        if panel_ids is None and isinstance(result_data.get('panels'), list):
+            panel_ids = _legacy_panel_ids(result_data['panels'], panels, known, claimed)
+            if panel_ids is None:
+                # Left as it is; the status endpoint still serves the summaries
+                logger.warning(f"Keeping the legacy panel list of job {job_id}: not all its panels exist")
+                continue
+        if panel_ids is None:
+            continue
+        claimed.update(panel_ids)
+        result_data.pop('panel_ids', None)
+        result_data.pop('panels', None)
+        if panel_ids:
+            conn.execute(insert(JobPanel.__table__), [
+                {"job_id": job_id, "position": position, "panel_id": panel_id}
+                for position, panel_id in enumerate(panel_ids)
+            ])
+        conn.execute(update, {"id": job_id, "value": compress_value(
+            json.dumps(result_data, separators=(',', ':')).encode('utf-8')
+        )})
+
+
+# Append only: (version, name, upgrade function). Each runs in its own transaction.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "add lookup indexes", _add_lookup_indexes),
+    (2, "derive parsed_data from scenes, compress large columns", _store_scripts_compactly),
+    (3, "add panel fingerprints", _add_panel_fingerprints),
+    (4, "move job panel lists into job_panels", _move_job_panels_to_rows),
+    (5, "add full-text script search index", create_search_index),
+]
+
+# Migrations that free enough space to be worth a VACUUM on SQLite
+VACUUM_AFTER = {2}
+
+
+def run_migrations(engine: Engine):
+    """Bring an existing database up to the current schema version"""
+    _version_metadata.create_all(bind=engine)
+
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+    vacuum = False
+    for version, name, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info(f"Applying schema migration {version}: {name}")
+        with engine.begin() as conn:
+            upgrade(conn)
+            conn.execute(insert(schema_migrations).values(version=version, name=name, applied_at=datetime.utcnow()))
+        vacuum = vacuum or version in VACUUM_AFTER
+
+    if vacuum and engine.dialect.name == "sqlite":
+        # VACUUM cannot run inside a transaction
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
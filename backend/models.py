@@ -1,25 +1,86 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Float, ForeignKey, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+import json
 import uuid
+import zlib
 
 Base = declarative_base()
 
+# Stored values start with a one-byte marker so small values can skip
+# compression and rows written before compression (plain text) still read
+COMPRESSED_MARKER = b"\x01"
+RAW_MARKER = b"\x00"
+COMPRESS_MIN_BYTES = 256
+
+def compress_value(data: bytes) -> bytes:
+    if len(data) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data, 6)
+        if len(compressed) < len(data):
+            return COMPRESSED_MARKER + compressed
+    return RAW_MARKER + data
+
+def decompress_value(value) -> str:
+    if isinstance(value, str):
+        # Legacy uncompressed row
+        return value
+    value = bytes(value)
+    if value[:1] == COMPRESSED_MARKER:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    if value[:1] == RAW_MARKER:
+        return value[1:].decode('utf-8')
+    return value.decode('utf-8')
+
+class CompressedText(TypeDecorator):
+    """Text column stored zlib-compressed"""
+    impl = LargeBinary
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_value(value.encode('utf-8'))
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_value(value)
+
+class CompressedJSON(TypeDecorator):
+    """JSON column stored zlib-compressed"""
+    impl = LargeBinary
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_value(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return json.loads(decompress_value(value))
+
 class Script(Base):
     __tablename__ = "scripts"
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     title = Column(String, nullable=False)
-    content = Column(Text, nullable=False)  # Raw script content
+    content = Column(CompressedText, nullable=False)  # Raw script content
     style = Column(String, nullable=False)  # shounen, shoujo, etc
-    parsed_data = Column(JSON)  # Parsed scenes and structure
+    # Parsed structure is not stored; it is rebuilt from the Scene rows
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    scenes = relationship("Scene", back_populates="script", cascade="all, delete-orphan")
+    scenes = relationship("Scene", back_populates="script", cascade="all, delete-orphan", order_by="Scene.order")
     generation_jobs = relationship("GenerationJob", back_populates="script")
+    
+    __table_args__ = (
+        Index("ix_scripts_created_at", "created_at"),
+    )
 
 class Character(Base):
     __tablename__ = "characters"
@@ -30,6 +91,10 @@ class Character(Base):
     tags = Column(JSON)  # Array of tags
     image_ref = Column(String)  # URL or file path
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_characters_created_at", "created_at"),
+    )
 
 class Scene(Base):
     __tablename__ = "scenes"
@@ -39,14 +104,21 @@ class Scene(Base):
     order = Column(Integer, nullable=False)
     scene_type = Column(String)  # action, dialogue, etc
     characters = Column(JSON)  # Characters in this scene
-    dialogue = Column(JSON)  # Array of dialogue
+    dialogue = Column(JSON)  # Array of {speaker, text} (plain strings in older rows)
     action = Column(Text)  # Action description
+    actions = Column(JSON)  # Individual actions as parsed
     location = Column(String)  # Scene location
+    time = Column(String)  # Time of day from the scene header
     mood = Column(String)  # Scene mood/emotion
     
     # Relationships
     script = relationship("Script", back_populates="scenes")
     panels = relationship("Panel", back_populates="scene", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Scenes are always read per script in order
+        Index("ix_scenes_script_id_order", "script_id", "order"),
+    )
 
 class Panel(Base):
     __tablename__ = "panels"
@@ -56,10 +128,16 @@ class Panel(Base):
     image_url = Column(String)  # Generated image URL
     prompt_used = Column(Text)  # Stable Diffusion prompt
     generation_metadata = Column(JSON)  # Model, seed, parameters
+    fingerprint = Column(String)  # Hash of prompt, model and render settings; reused while unchanged
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     scene = relationship("Scene", back_populates="panels")
+    
+    __table_args__ = (
+        # Newest panel per scene
+        Index("ix_panels_scene_id_created_at", "scene_id", "created_at"),
+    )
 
 class GenerationJob(Base):
     __tablename__ = "generation_jobs"
@@ -70,10 +148,22 @@ class GenerationJob(Base):
     progress = Column(Float, default=0.0)  # 0.0 to 1.0
     total_panels = Column(Integer)
     completed_panels = Column(Integer, default=0)
-    result_data = Column(JSON)  # Generated panels info
+    result_data = Column(CompressedJSON)  # Small summary (reused panel count); panels are in job_panels
     error_message = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    script = relationship("Script", back_populates="generation_jobs")
\ No newline at end of file
+    script = relationship("Script", back_populates="generation_jobs")
+    
+    __table_args__ = (
+        Index("ix_generation_jobs_script_id_created_at", "script_id", "created_at"),
+    )
+
+class JobPanel(Base):
+    __tablename__ = "job_panels"
+    
+    # (job_id, position) is the primary key, so "panels since N" is a range scan
+    job_id = Column(String, ForeignKey("generation_jobs.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, primary_key=True)  # Order of the result within the job
+    panel_id = Column(String, ForeignKey("panels.id", ondelete="CASCADE"), nullable=False)
@@ -0,0 +1,148 @@
+import os
+import logging
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple
+import numpy as np
+from PIL import Image
+
+from image_store import get_image_store
+
+logger = logging.getLogger(__name__)
+
+# Page canvas: B5 manga page at ~200 dpi
+PAGE_WIDTH = 1433
+PAGE_HEIGHT = 2024
+PAGE_MARGIN = 60
+
+# Panel slots as (x, y, width, height) fractions of the live area
+LAYOUTS = {
+    "splash": [(0.0, 0.0, 1.0, 1.0)],
+    "tall_pair": [(0.0, 0.0, 0.5, 1.0), (0.5, 0.0, 0.5, 1.0)],
+    "wide_pair": [(0.0, 0.0, 1.0, 0.5), (0.0, 0.5, 1.0, 0.5)],
+    "feature_3": [(0.0, 0.0, 1.0, 0.6), (0.0, 0.6, 0.5, 0.4), (0.5, 0.6, 0.5, 0.4)],
+    "strip_3": [(0.0, 0.0, 1.0, 1 / 3), (0.0, 1 / 3, 1.0, 1 / 3), (0.0, 2 / 3, 1.0, 1 / 3)],
+    "grid_4": [(0.0, 0.0, 0.5, 0.5), (0.5, 0.0, 0.5, 0.5), (0.0, 0.5, 0.5, 0.5), (0.5, 0.5, 0.5, 0.5)],
+}
+
+# Layout to use when fewer panels remain than the preferred layout holds
+LAYOUT_FOR_COUNT = {1: "splash", 2: "tall_pair", 3: "strip_3", 4: "grid_4"}
+
+# Decoded panels kept per worker process; names are content-hashed so
+# entries never go stale
+PANEL_CACHE_SIZE = int(os.environ.get('PAGE_PANEL_CACHE_SIZE', 64))
+
+
+def choose_layout(panel: Dict[str, Any]) -> str:
+    """Preferred layout for a page that opens with this panel"""
+    scene_type = panel.get('scene_type')
+    mood = panel.get('mood')
+
+    if scene_type == 'battle':
+        # Climactic fights get the whole page
+        return "splash" if mood == 'intense' else "feature_3"
+    if scene_type == 'social':
+        return "strip_3"
+    if scene_type == 'romance' or mood in ('romantic', 'sad'):
+        return "tall_pair"
+    if mood == 'intense':
+        return "wide_pair"
+    return "grid_4"
+
+
+def plan_pages(panels: List[Dict[str, Any]], gutter: int = 20, border: int = 4) -> List[Dict[str, Any]]:
+    """Group ordered panels into pages and pick a layout for each.
+
+    Each panel dict needs the stored image `name`, and may carry `panel_id`, `scene_type`
+    and `mood`. The returned plans are plain dicts so they can be shipped
+    to worker processes.
+    """
+    plans = []
+    i = 0
+    while i < len(panels):
+        layout = choose_layout(panels[i])
+        capacity = len(LAYOUTS[layout])
+        remaining = len(panels) - i
+        if remaining < capacity:
+            layout = LAYOUT_FOR_COUNT[remaining]
+            capacity = remaining
+
+        page_panels = panels[i:i + capacity]
+        plans.append({
+            'page': len(plans) + 1,
+            'layout': layout,
+            'names': [p['name'] for p in page_panels],
+            'panel_ids': [p.get('panel_id') for p in page_panels],
+            'gutter': gutter,
+            'border': border,
+        })
+        i += capacity
+    return plans
+
+
+def render_page(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Composite one page and store it. Runs inside a worker process."""
+    canvas = np.full((PAGE_HEIGHT, PAGE_WIDTH, 3), 255, dtype=np.uint8)
+    gutter = plan['gutter']
+    border = plan['border']
+
+    for (fx, fy, fw, fh), name in zip(LAYOUTS[plan['layout']], plan['names']):
+        x0, y0, x1, y1 = _slot_rect(fx, fy, fw, fh, gutter)
+        inner = _fit_panel(name, x1 - x0 - 2 * border, y1 - y0 - 2 * border)
+        if inner is not None:
+            canvas[y0 + border:y1 - border, x0 + border:x1 - border] = inner
+        if border > 0:
+            canvas[y0:y0 + border, x0:x1] = 0
+            canvas[y1 - border:y1, x0:x1] = 0
+            canvas[y0:y1, x0:x0 + border] = 0
+            canvas[y0:y1, x1 - border:x1] = 0
+
+    store = get_image_store()
+    page_name = store.save_image(Image.fromarray(canvas), prefix="page")
+    return {
+        'page': plan['page'],
+        'layout': plan['layout'],
+        'panel_ids': plan['panel_ids'],
+        'image_url': store.url_for(page_name),
+    }
+
+
+def _slot_rect(fx: float, fy: float, fw: float, fh: float, gutter: int) -> Tuple[int, int, int, int]:
+    """Pixel rectangle of a slot, with half a gutter taken off each inner edge"""
+    live_w = PAGE_WIDTH - 2 * PAGE_MARGIN
+    live_h = PAGE_HEIGHT - 2 * PAGE_MARGIN
+    half = gutter // 2
+
+    x0 = PAGE_MARGIN + round(fx * live_w) + (half if fx > 0 else 0)
+    y0 = PAGE_MARGIN + round(fy * live_h) + (half if fy > 0 else 0)
+    x1 = PAGE_MARGIN + round((fx + fw) * live_w) - (half if fx + fw < 1 else 0)
+    y1 = PAGE_MARGIN + round((fy + fh) * live_h) - (half if fy + fh < 1 else 0)
+    return x0, y0, x1, y1
+
+
+def _fit_panel(name: str, width: int, height: int):
+    """Cover-crop a decoded panel to the slot size as an RGB array"""
+    if width <= 0 or height <= 0:
+        return None
+    try:
+        source = _load_panel(name)
+    except Exception as e:
+        logger.warning(f"Cannot decode panel {name}: {str(e)}")
+        return None
+
+    src_h, src_w = source.shape[:2]
+    scale = max(width / src_w, height / src_h)
+    crop_w = min(src_w, round(width / scale))
+    crop_h = min(src_h, round(height / scale))
+    left = (src_w - crop_w) // 2
+    top = (src_h - crop_h) // 2
+
+    cropped = Image.fromarray(source[top:top + crop_h, left:left + crop_w])
+    return np.asarray(cropped.resize((width, height), Image.LANCZOS))
+
+
+@lru_cache(maxsize=PANEL_CACHE_SIZE)
+def _load_panel(name: str) -> np.ndarray:
+    with get_image_store().open(name) as source, Image.open(source) as img:
+        array = np.asarray(img.convert("RGB"))
+    array.setflags(write=False)
+    return array
@@ -0,0 +1,74 @@
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+# Hard limits so a forgotten profile can't run (or grow) forever
+MAX_PROFILE_SECONDS = 300
+MIN_INTERVAL_SECONDS = 0.001
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler for the whole process.
+
+    A daemon thread snapshots every thread's stack with sys._current_frames
+    at a fixed interval and counts identical stacks. Nothing is installed
+    while no profile is running, so it costs nothing when idle. Output is
+    in "collapsed" form (frame;frame;frame count), which flamegraph.pl,
+    speedscope and inferno all read.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = max(interval, MIN_INTERVAL_SECONDS)
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.time()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + MAX_PROFILE_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.samples[self._collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.sample_count += 1
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.append(thread_name)
+        return ";".join(reversed(stack))
+
+    def collapsed(self) -> str:
+        """Flamegraph input: one "stack count" line per distinct stack"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "interval_seconds": self.interval,
+            "samples": self.sample_count,
+            "distinct_stacks": len(self.samples),
+        }
@@ -0,0 +1,123 @@
+import io
+import os
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import requests
+from PIL import Image
+
+from image_store import ImageStore
+from metrics import record_cache, stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Encoded references kept per process; each is a few hundred KB of base64
+REFERENCE_CACHE_SIZE = int(os.environ.get('REFERENCE_CACHE_SIZE', 64))
+# Longest side a reference is scaled down to before it is sent to SD
+REFERENCE_IMAGE_SIZE = int(os.environ.get('REFERENCE_IMAGE_SIZE', 512))
+REFERENCE_FETCH_TIMEOUT = float(os.environ.get('REFERENCE_FETCH_TIMEOUT_SECONDS', 10))
+
+
+class ReferenceImageCache:
+    """Character reference images, decoded, resized and base64-encoded once.
+
+    Entries are keyed by the image's content hash: for images in our own
+    store that is the digest in the name, so a hit costs no I/O at all;
+    other references (http(s) or data: URLs) are fetched once and hashed,
+    and the URL is remembered. A 300-panel job with five recurring
+    characters encodes five images.
+    """
+
+    def __init__(self, image_store: ImageStore, max_entries: int = REFERENCE_CACHE_SIZE,
+                 size: int = REFERENCE_IMAGE_SIZE):
+        self.image_store = image_store
+        self.max_entries = max_entries
+        self.size = size
+        self.encodes = 0
+        self._encoded: "OrderedDict[str, str]" = OrderedDict()
+        self._digests: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per digest being encoded, so concurrent panels wait for
+        # the first encode instead of repeating it
+        self._pending: Dict[str, threading.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._encoded)
+
+    def get(self, image_ref: str) -> Optional[str]:
+        """Base64 PNG for a reference, or None if it can't be loaded"""
+        try:
+            return self._get(image_ref)
+        except Exception as e:
+            logger.warning(f"Skipping reference image {image_ref[:100]}: {str(e)}")
+            return None
+
+    def _get(self, image_ref: str) -> str:
+        name = self.image_store.name_from_url(image_ref)
+        data = None
+        digest = self.image_store.content_digest(name) if name else None
+        if digest is None:
+            with self._lock:
+                digest = self._digests.get(image_ref)
+            if digest is None:
+                data = self._read(image_ref, name)
+                digest = hashlib.sha256(data).hexdigest()
+                self._remember(self._digests, image_ref, digest)
+
+        encoded = self._lookup(digest)
+        record_cache("reference_image", encoded is not None)
+        if encoded is not None:
+            return encoded
+
+        with self._lock:
+            pending = self._pending.setdefault(digest, threading.Lock())
+        with pending:
+            encoded = self._lookup(digest)
+            if encoded is None:
+                if data is None:
+                    data = self._read(image_ref, name)
+                with stage_timer("encode_reference"):
+                    encoded = self._encode(data)
+                self._remember(self._encoded, digest, encoded)
+                self.encodes += 1
+        with self._lock:
+            self._pending.pop(digest, None)
+        return encoded
+
+    def _lookup(self, digest: str) -> Optional[str]:
+        with self._lock:
+            encoded = self._encoded.get(digest)
+            if encoded is not None:
+                self._encoded.move_to_end(digest)
+            return encoded
+
+    def _remember(self, cache: "OrderedDict[str, str]", key: str, value: str):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+
+    def _read(self, image_ref: str, name: Optional[str]) -> bytes:
+        if name:
+            with self.image_store.open(name) as f:
+                return f.read()
+        if image_ref.startswith("data:"):
+            return base64.b64decode(image_ref.split(",", 1)[1])
+        if image_ref.startswith(("http://", "https://")):
+            response = requests.get(image_ref, timeout=REFERENCE_FETCH_TIMEOUT)
+            response.raise_for_status()
+            return response.content
+        raise ValueError("unsupported reference URL")
+
+    def _encode(self, data: bytes) -> str:
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+            img.thumbnail((self.size, self.size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG")
+        return base64.b64encode(buffer.getvalue()).decode("ascii")
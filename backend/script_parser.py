@@ -2,6 +2,9 @@ import re
 from typing import List, Dict, Any
 import json
 
+from metrics import timed_stage
+
+
 class ScriptParser:
     """Parse structured manga script into scenes and panels"""
     
@@ -11,6 +14,7 @@ class ScriptParser:
         self.action_pattern = r'\[ACTION:\s*([^\]]+)\]'
         self.dialogue_pattern = r'\[DIALOGUE:\s*([^\]]+?)\]\s*"([^"]+)"'
     
+    @timed_stage("parse_script")
     def parse_script(self, script_content: str) -> Dict[str, Any]:
         """Parse complete script into structured data"""
         scenes = []
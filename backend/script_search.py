@@ -0,0 +1,198 @@
+import re
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import String, bindparam, cast, func, or_, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Scene, Script
+from script_store import dialogue_lines
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = "script_search"
+SNIPPET_START, SNIPPET_END = "<mark>", "</mark>"
+SNIPPET_TOKENS = 16
+# bm25 column weights: a title hit outranks a location hit outranks text
+RANK_WEIGHTS = "bm25(10.0, 3.0, 1.0, 1.0)"
+_WORD = re.compile(r"\w+")
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+# One row per script (title) and one per scene (location, action, dialogue).
+# Script.content is covered through its scenes, which are parsed from it.
+_CREATE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "title, location, action, dialogue, script_id UNINDEXED, scene_order UNINDEXED, "
+    "tokenize = 'porter unicode61 remove_diacritics 2')"
+)
+_INSERT = text(
+    f"INSERT INTO {SEARCH_TABLE} (title, location, action, dialogue, script_id, scene_order) "
+    "VALUES (:title, :location, :action, :dialogue, :script_id, :scene_order)"
+)
+_DELETE = text(f"DELETE FROM {SEARCH_TABLE} WHERE script_id IN :ids").bindparams(bindparam("ids", expanding=True))
+_SEARCH = text(
+    f"SELECT {SEARCH_TABLE}.script_id, scripts.title, scenes.id, {SEARCH_TABLE}.scene_order, {SEARCH_TABLE}.location, "
+    f"snippet({SEARCH_TABLE}, -1, '{SNIPPET_START}', '{SNIPPET_END}', '…', {SNIPPET_TOKENS}), rank "
+    f"FROM {SEARCH_TABLE} JOIN scripts ON scripts.id = {SEARCH_TABLE}.script_id "
+    f"LEFT JOIN scenes ON scenes.script_id = {SEARCH_TABLE}.script_id AND scenes.\"order\" = {SEARCH_TABLE}.scene_order "
+    f"WHERE {SEARCH_TABLE} MATCH :query ORDER BY rank LIMIT :limit OFFSET :offset"
+)
+_COUNT = text(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :query")
+
+# Whether this process's database has the FTS table; checked once
+_enabled: Optional[bool] = None
+
+
+def create_search_index(conn: Connection):
+    """Create and fill the FTS5 table; databases without FTS5 use LIKE search"""
+    if conn.dialect.name != "sqlite":
+        return
+    try:
+        conn.execute(text(_CREATE))
+    except OperationalError as e:
+        logger.warning(f"SQLite has no FTS5 ({str(e)}); script search falls back to LIKE")
+        return
+    conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', :rank)"), {"rank": RANK_WEIGHTS})
+
+    titles = conn.execute(text("SELECT id, title FROM scripts")).all()
+    if titles:
+        conn.execute(_INSERT, [_script_row(script_id, title) for script_id, title in titles])
+    scenes = conn.execute(
+        select(Scene.script_id, Scene.order, Scene.location, Scene.action, Scene.dialogue)
+    ).all()
+    if scenes:
+        conn.execute(_INSERT, [
+            _scene_row(script_id, order, location, action, dialogue)
+            for script_id, order, location, action, dialogue in scenes
+        ])
+
+
+def _script_row(script_id: str, title: str) -> Dict[str, Any]:
+    return {"title": title, "location": None, "action": None, "dialogue": None,
+            "script_id": script_id, "scene_order": None}
+
+
+def _scene_row(script_id: str, order: int, location: Optional[str], action: Optional[str], dialogue: Any) -> Dict[str, Any]:
+    lines = dialogue_lines(dialogue)
+    return {
+        "title": None,
+        "location": location,
+        "action": action,
+        "dialogue": "\n".join(f"{line['speaker']}: {line['text']}" if line['speaker'] else line['text'] for line in lines),
+        "script_id": script_id,
+        "scene_order": order,
+    }
+
+
+async def search_index_enabled(db: AsyncSession) -> bool:
+    global _enabled
+    if _enabled is None:
+        if db.bind.dialect.name != "sqlite":
+            _enabled = False
+        else:
+            result = await db.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": SEARCH_TABLE}
+            )
+            _enabled = result.scalar() is not None
+    return _enabled
+
+
+async def index_scripts(db: AsyncSession, scripts: Iterable[Tuple[Script, Sequence[Scene]]], replace: bool = False):
+    """Add (script, scenes) to the index in the caller's transaction.
+
+    `replace` drops the scripts' old rows first; that is a scan of the
+    index, so new scripts skip it.
+    """
+    if not await search_index_enabled(db):
+        return
+    scripts = list(scripts)
+    if replace and scripts:
+        await db.execute(_DELETE, {"ids": [script.id for script, _ in scripts]})
+    rows = []
+    for script, scenes in scripts:
+        rows.append(_script_row(script.id, script.title))
+        rows += [_scene_row(script.id, scene.order, scene.location, scene.action, scene.dialogue) for scene in scenes]
+    if rows:
+        await db.execute(_INSERT, rows)
+
+
+def match_query(query: str) -> Optional[str]:
+    """FTS5 MATCH expression for user input: all terms must occur; "quoted
+    phrases" stay together and the last bare word also matches as a prefix
+    """
+    terms = []
+    for phrase, word in _TERM.findall(query or ""):
+        words = _WORD.findall(phrase or word)
+        if words:
+            terms.append((" ".join(words), not phrase))
+    if not terms:
+        return None
+    expression = [f'"{words}"' for words, _ in terms]
+    if terms[-1][1]:
+        expression[-1] += "*"
+    return " ".join(expression)
+
+
+async def search_scripts(db: AsyncSession, query: str, limit: int = 20, offset: int = 0) -> Tuple[int, List[Dict[str, Any]]]:
+    """(total hits, page of hits) best first; a hit is a script title or a scene"""
+    expression = match_query(query)
+    if expression is None:
+        return 0, []
+    if not await search_index_enabled(db):
+        return await _like_search(db, _WORD.findall(query), limit, offset)
+
+    total = (await db.execute(_COUNT, {"query": expression})).scalar()
+    rows = await db.execute(_SEARCH, {"query": expression, "limit": limit, "offset": offset})
+    return total, [
+        _hit(script_id, title, scene_id, scene_order, location, snippet, -rank)
+        for script_id, title, scene_id, scene_order, location, snippet, rank in rows.all()
+    ]
+
+
+def _hit(script_id: str, title: str, scene_id: Optional[str], scene_order: Optional[int],
+         location: Optional[str], snippet: str, score: float) -> Dict[str, Any]:
+    return {
+        "script_id": script_id,
+        "title": title,
+        "scene_id": scene_id,
+        "scene_order": scene_order,
+        "location": location,
+        "snippet": snippet,
+        "score": round(score, 6),
+    }
+
+
+async def _like_search(db: AsyncSession, words: List[str], limit: int, offset: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """Scene hits by substring match, newest scripts first; unranked"""
+    dialogue = cast(Scene.dialogue, String)
+    conditions = [
+        or_(*[func.lower(column).contains(word.lower(), autoescape=True)
+              for column in (Script.title, Scene.location, Scene.action, dialogue)])
+        for word in words
+    ]
+    matches = select(Scene.script_id, Script.title, Scene.id, Scene.order, Scene.location, Scene.action, Scene.dialogue) \
+        .join(Script, Script.id == Scene.script_id).where(*conditions)
+    total = (await db.execute(select(func.count()).select_from(matches.subquery()))).scalar()
+    rows = await db.execute(matches.order_by(Script.created_at.desc(), Scene.order).limit(limit).offset(offset))
+
+    hits = []
+    for script_id, title, scene_id, order, location, action, dialogue_value in rows.all():
+        row = _scene_row(script_id, order, location, action, dialogue_value)
+        fields = [row['dialogue'], row['action'], row['location'], title]
+        hits.append(_hit(script_id, title, scene_id, order, location, _like_snippet(fields, words), 0.0))
+    return total, hits
+
+
+def _like_snippet(fields: List[Optional[str]], words: List[str]) -> str:
+    """A window of the first field containing a term, terms marked like FTS5 snippets"""
+    pattern = re.compile("|".join(re.escape(word) for word in words), re.IGNORECASE)
+    for value in fields:
+        match = pattern.search(value or "")
+        if match:
+            start = max(0, match.start() - 60)
+            window = value[start:match.end() + 60]
+            marked = pattern.sub(lambda m: f"{SNIPPET_START}{m.group(0)}{SNIPPET_END}", window)
+            return ("…" if start > 0 else "") + marked + ("…" if match.end() + 60 < len(value) else "")
+    return ""
@@ -0,0 +1,116 @@
+from typing import List, Dict, Any, Iterable, Tuple
+
+from models import Scene
+
+
+def scenes_from_parsed(script_id: str, parsed_data: Dict[str, Any]) -> List[Scene]:
+    """Scene rows for a freshly parsed script; they are the only stored copy"""
+    return [
+        Scene(
+            script_id=script_id,
+            order=scene_data['order'],
+            scene_type=scene_data['scene_type'],
+            characters=scene_data['characters'],
+            dialogue=scene_data['dialogue'],
+            action=', '.join(scene_data['actions']),
+            actions=scene_data['actions'],
+            location=scene_data['location'],
+            time=scene_data['time'],
+            mood=scene_data['mood']
+        )
+        for scene_data in parsed_data['scenes']
+    ]
+
+
+SCENE_FIELDS = ('scene_type', 'characters', 'dialogue', 'action', 'actions', 'location', 'time', 'mood')
+
+
+def merge_scenes(script_id: str, existing: Iterable[Scene], parsed_data: Dict[str, Any]) -> Tuple[List[Scene], List[Scene]]:
+    """Apply a re-parsed script to its Scene rows, matching scenes by order.
+    
+    Matched rows are updated in place and keep their ids, and with them
+    their panels, so unchanged scenes can reuse their art. Returns the
+    scenes to keep (new ones included) and the ones to delete.
+    """
+    current = {scene.order: scene for scene in existing}
+    kept = []
+    for scene in scenes_from_parsed(script_id, parsed_data):
+        row = current.pop(scene.order, None)
+        if row is None:
+            kept.append(scene)
+            continue
+        for field in SCENE_FIELDS:
+            if getattr(row, field) != getattr(scene, field):
+                setattr(row, field, getattr(scene, field))
+        kept.append(row)
+    return kept, list(current.values())
+
+
+def scene_actions(scene: Scene) -> List[str]:
+    if scene.actions is not None:
+        return list(scene.actions)
+    # Rows from before actions were stored individually
+    return scene.action.split(', ') if scene.action else []
+
+
+def scene_dialogue(scene: Scene) -> List[Dict[str, str]]:
+    """Dialogue as {speaker, text} dicts, whatever shape the row stores"""
+    return dialogue_lines(scene.dialogue)
+
+
+def dialogue_lines(stored: Any) -> List[Dict[str, str]]:
+    """A stored dialogue column value as {speaker, text} dicts"""
+    dialogue = []
+    for line in stored or []:
+        if isinstance(line, dict):
+            dialogue.append({'speaker': line.get('speaker', ''), 'text': line.get('text', '')})
+        else:
+            dialogue.append({'speaker': '', 'text': line})
+    return dialogue
+
+
+def scene_to_parsed(scene: Scene) -> Dict[str, Any]:
+    """Scene row in the shape ScriptParser produces"""
+    return {
+        'id': f"scene_{scene.order}",
+        'order': scene.order,
+        'location': scene.location,
+        'time': scene.time or "Unknown",
+        'characters': scene.characters or [],
+        'actions': scene_actions(scene),
+        'dialogue': scene_dialogue(scene),
+        'scene_type': scene.scene_type,
+        'mood': scene.mood
+    }
+
+
+def parsed_data_from_scenes(scenes: Iterable[Scene]) -> Dict[str, Any]:
+    """Rebuild ScriptParser output from a script's Scene rows"""
+    parsed_scenes = [scene_to_parsed(scene) for scene in sorted(scenes, key=lambda s: s.order)]
+
+    character_list = []
+    seen = set()
+    for scene in parsed_scenes:
+        for char in scene['characters']:
+            if char['name'] not in seen:
+                seen.add(char['name'])
+                character_list.append(char['name'])
+
+    return {
+        'scenes': parsed_scenes,
+        'character_list': character_list,
+        'total_scenes': len(parsed_scenes)
+    }
+
+
+def scene_generation_data(scene: Scene) -> Dict[str, Any]:
+    """Scene data as StableDiffusionGenerator.generate_panel expects it"""
+    return {
+        'id': scene.id,
+        'characters': scene.characters,
+        'actions': scene_actions(scene),
+        'dialogue': scene_dialogue(scene),
+        'location': scene.location,
+        'mood': scene.mood,
+        'scene_type': scene.scene_type
+    }
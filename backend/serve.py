@@ -0,0 +1,50 @@
+"""Serve the API with several worker processes: `python serve.py`.
+
+Applies schema migrations once, resets the host's shared cache and puts
+Prometheus metrics into multiprocess mode, then hands over to uvicorn's
+process manager, which starts the workers up front and shares the listening
+socket between them. It does not replace a worker that dies; the rest keep
+serving. Run this under a supervisor that restarts the whole group.
+"""
+import os
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 8001))
+# uvicorn's and gunicorn's conventional variable; one worker per CPU by default
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 0)) or os.cpu_count() or 1
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if WORKERS > 1:
+        metrics_dir = os.environ.setdefault(
+            'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'manga_prometheus')
+        )
+        # Files of a previous run would be added to this run's metrics
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+        # Split the CPU-bound image pool between workers rather than giving each one a process per CPU
+        os.environ.setdefault('MANGA_WORKER_PROCESSES', str(max(1, (os.cpu_count() or 1) // WORKERS)))
+
+    # Imported only now: both read the environment at import
+    from database import create_tables
+    from shared_cache import get_shared_cache
+
+    # Leases and health checks of a previous run mean nothing now
+    get_shared_cache().clear()
+    # Here, once: workers starting together would race to apply migrations
+    create_tables()
+
+    import uvicorn
+    logger.info(f"Starting {WORKERS} workers on {HOST}:{PORT}")
+    uvicorn.run("server:app", host=HOST, port=PORT, workers=WORKERS, app_dir=str(Path(__file__).parent))
+
+
+if __name__ == "__main__":
+    main()
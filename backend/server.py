@@ -1,8 +1,11 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, BackgroundTasks
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from fastapi.concurrency import run_in_threadpool
 import os
 import logging
 from pathlib import Path
@@ -11,30 +14,116 @@ from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime
 import asyncio
+import re
+import time
+import zlib
+import json
+import hashlib
+from contextlib import asynccontextmanager
+from functools import lru_cache
 
 # Import our modules
-from database import get_db, create_tables
-from models import Script, Character, Scene, Panel, GenerationJob
+from database import get_db, create_tables, AsyncSessionLocal, async_engine
+from models import Script, Character, Scene, Panel, GenerationJob, JobPanel
 from script_parser import ScriptParser
-from stable_diffusion import StableDiffusionGenerator
+from script_store import scenes_from_parsed, merge_scenes, parsed_data_from_scenes, scene_generation_data
+from stable_diffusion import StableDiffusionGenerator, FINAL_METHODS
+from image_store import get_image_store
+from image_server import ImmutableImageFiles
+from export import stream_zip, stream_pdf
+from page_composer import plan_pages, render_page
+from lettering import letter_panel
+from workers import get_process_pool, pool_size, prime_process_pool, shutdown_process_pool
+from image_gc import ImageGarbageCollector
+from character_index import CharacterIndex
+from script_search import index_scripts, search_scripts
+from shared_cache import get_shared_cache
+from bulk_import import (
+    parse_scripts, chunked, ndjson_batches, item_error, summarize, IMPORT_BATCH_SIZE, IMPORT_MAX_ITEMS
+)
+from metrics import (
+    RequestLatencyMiddleware, metrics_response, mark_worker_exited, stage_timer,
+    GENERATIONS_IN_FLIGHT, JOBS_QUEUED, PANELS_QUEUED, PROCESS_STARTED
+)
+from tracing import span, TracingMiddleware, TRACING_ENABLED
+from profiler import SamplingProfiler, MAX_PROFILE_SECONDS
+from warmup import StartupState, warm_up, WARMUP_ENABLED
+from admission import AdmissionController, Reservation, client_id
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Create database tables
-create_tables()
+# Services are built on first use, not at import, so importing this module
+# (tests, tooling, worker processes) touches neither the database nor disk
+@lru_cache(maxsize=None)
+def get_script_parser() -> ScriptParser:
+    return ScriptParser()
+
+@lru_cache(maxsize=None)
+def get_sd_generator() -> StableDiffusionGenerator:
+    return StableDiffusionGenerator(image_store=get_image_store())
+
+@lru_cache(maxsize=None)
+def get_image_gc() -> ImageGarbageCollector:
+    return ImageGarbageCollector.from_env(get_image_store(), AsyncSessionLocal, get_shared_cache())
+
+@lru_cache(maxsize=None)
+def get_character_index() -> CharacterIndex:
+    return CharacterIndex()
+
+# Serialises the full load against incremental updates, so a character
+# committed while the table is being scanned can't be lost
+_character_index_lock = asyncio.Lock()
+# Every worker process keeps its own index; a host-wide counter of character
+# changes tells each one when another process changed the table
+CHARACTER_INDEX_VERSION_KEY = "character_index_version"
+_character_index_version: Optional[int] = None
+
+startup_state = StartupState()
+admission = AdmissionController()
 
-# Initialize services
-script_parser = ScriptParser()
-sd_generator = StableDiffusionGenerator()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the schema before serving; warm everything else up in the background"""
+    started = time.perf_counter()
+    startup_state.record_timing("import", started - PROCESS_STARTED)
+    
+    await run_in_threadpool(create_tables)
+    startup_state.schema_ready = True
+    startup_state.record_timing("schema", time.perf_counter() - started)
+    
+    tasks = []
+    if os.environ.get('IMAGE_GC_ENABLED', 'true').lower() == 'true':
+        tasks.append(asyncio.create_task(get_image_gc().run_forever()))
+    
+    image_store = get_image_store()
+    if hasattr(image_store, 'migrate_flat_layout'):
+        # Images written before sharding sit in the store root; still served
+        # from there, moved into their shard directories in the background
+        tasks.append(asyncio.create_task(run_in_threadpool(image_store.migrate_flat_layout)))
+    
+    if WARMUP_ENABLED:
+        tasks.append(asyncio.create_task(
+            warm_up(startup_state, async_engine, get_sd_generator(), prime_process_pool)
+        ))
+    else:
+        startup_state.warmup_done = True
+    
+    startup_state.record_timing("startup", time.perf_counter() - started)
+    logger.info(f"Accepting requests {time.perf_counter() - PROCESS_STARTED:.2f}s after import")
+    
+    yield
+    
+    for task in tasks:
+        task.cancel()
+    shutdown_process_pool()
+    mark_worker_exited()
 
 # Create the main app without a prefix
-app = FastAPI(title="Manga Creator API", version="1.0.0")
+app = FastAPI(title="Manga Creator API", version="1.0.0", lifespan=lifespan)
 
-# Mount static files for generated images
-images_dir = Path("./generated_images")
-images_dir.mkdir(exist_ok=True)
-app.mount("/images", StaticFiles(directory=str(images_dir)), name="images")
+# Serve generated images with immutable caching, ETags and ranges
+app.mount("/images", ImmutableImageFiles(), name="images")
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -45,6 +134,11 @@ class ScriptCreate(BaseModel):
     content: str
     style: str = "shounen"
 
+class ScriptUpdate(BaseModel):
+    title: Optional[str] = None
+    content: Optional[str] = None
+    style: Optional[str] = None
+
 class ScriptResponse(BaseModel):
     id: str
     title: str
@@ -67,11 +161,54 @@ class CharacterResponse(BaseModel):
     image_ref: Optional[str]
     created_at: datetime
 
+class CharacterSearchResult(CharacterResponse):
+    score: float
+
+class CharacterSearchResponse(BaseModel):
+    total: int
+    results: List[CharacterSearchResult]
+
+class ScriptSearchHit(BaseModel):
+    script_id: str
+    title: str
+    scene_id: Optional[str] = None  # None for a hit on the script title
+    scene_order: Optional[int] = None
+    location: Optional[str] = None
+    snippet: str
+    score: float
+
+class ScriptSearchResponse(BaseModel):
+    total: int
+    results: List[ScriptSearchHit]
+
+class CharacterResolveRequest(BaseModel):
+    names: List[str] = []
+    script_id: Optional[str] = None
+
+class BulkScriptImport(BaseModel):
+    # Raw items so one bad entry is reported in its result, not as a 422 for all
+    scripts: List[Any]
+
+class BulkCharacterImport(BaseModel):
+    characters: List[Any]
+
 class GenerationRequest(BaseModel):
     script_id: str
     style: str = "shounen"
     options: Dict[str, Any] = {}
 
+class SceneRegenerationRequest(BaseModel):
+    style: Optional[str] = None
+    options: Dict[str, Any] = {}
+
+class FinalGenerationRequest(BaseModel):
+    script_id: str
+    # Approved draft panels; each is re-rendered at full quality with its seed
+    panel_ids: List[str]
+    method: str = "hires"
+    style: Optional[str] = None
+    options: Dict[str, Any] = {}
+
 class GenerationStatusResponse(BaseModel):
     id: str
     status: str
@@ -80,93 +217,245 @@ class GenerationStatusResponse(BaseModel):
     completed_panels: int
     result_data: Optional[Dict[str, Any]]
     error_message: Optional[str]
+    # Results stored so far; `panels` is the slice requested with since/limit
+    panel_count: int = 0
+    panels: List[Dict[str, Any]] = []
+    next_since: int = 0
 
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
     return {"message": "Manga Creator API", "version": "1.0.0"}
 
+@api_router.get("/ready")
+async def readiness():
+    """503 until the schema exists and warm-up has finished"""
+    return JSONResponse(startup_state.to_dict(), status_code=200 if startup_state.ready else 503)
+
 # Script Management
+def _script_response(script: Script, scenes: List[Scene]) -> ScriptResponse:
+    return ScriptResponse(
+        id=script.id,
+        title=script.title,
+        content=script.content,
+        style=script.style,
+        parsed_data=parsed_data_from_scenes(scenes),
+        created_at=script.created_at
+    )
+
 @api_router.post("/scripts/parse", response_model=ScriptResponse)
-async def parse_script(script_data: ScriptCreate, db: Session = Depends(get_db)):
+async def parse_script(script_data: ScriptCreate, db: AsyncSession = Depends(get_db)):
     """Parse and save a manga script"""
     try:
         # Parse script content
-        parsed_data = script_parser.parse_script(script_data.content)
+        parsed_data = get_script_parser().parse_script(script_data.content)
         
         # Create script record
         script = Script(
             title=script_data.title,
             content=script_data.content,
-            style=script_data.style,
-            parsed_data=parsed_data
+            style=script_data.style
         )
         
         db.add(script)
-        db.commit()
-        db.refresh(script)
+        await db.flush()
         
-        # Create scene records
-        for scene_data in parsed_data['scenes']:
-            scene = Scene(
-                script_id=script.id,
-                order=scene_data['order'],
-                scene_type=scene_data['scene_type'],
-                characters=scene_data['characters'],
-                dialogue=[d['text'] for d in scene_data['dialogue']],
-                action=', '.join(scene_data['actions']),
-                location=scene_data['location'],
-                mood=scene_data['mood']
-            )
-            db.add(scene)
+        # Create scene records (the only stored copy of the parsed structure)
+        scenes = scenes_from_parsed(script.id, parsed_data)
+        db.add_all(scenes)
+        await index_scripts(db, [(script, scenes)])
         
-        db.commit()
+        await db.commit()
         
-        return ScriptResponse(
-            id=script.id,
-            title=script.title,
-            content=script.content,
-            style=script.style,
-            parsed_data=script.parsed_data,
-            created_at=script.created_at
-        )
+        return _script_response(script, scenes)
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error parsing script: {str(e)}")
 
 @api_router.get("/scripts", response_model=List[ScriptResponse])
-async def get_scripts(db: Session = Depends(get_db)):
+async def get_scripts(db: AsyncSession = Depends(get_db)):
     """Get all scripts"""
-    scripts = db.query(Script).order_by(Script.created_at.desc()).all()
-    return [ScriptResponse(
-        id=script.id,
-        title=script.title,
-        content=script.content,
-        style=script.style,
-        parsed_data=script.parsed_data,
-        created_at=script.created_at
-    ) for script in scripts]
+    result = await db.execute(
+        select(Script).options(selectinload(Script.scenes)).order_by(Script.created_at.desc())
+    )
+    scripts = result.scalars().all()
+    return [_script_response(script, script.scenes) for script in scripts]
+
+@api_router.get("/scripts/search", response_model=ScriptSearchResponse)
+async def search_script_library(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """Full-text search over script titles and scene locations, actions and dialogue"""
+    with span("scripts.search"):
+        total, hits = await search_scripts(db, q, limit, offset)
+    return ScriptSearchResponse(total=total, results=[ScriptSearchHit(**hit) for hit in hits])
 
 @api_router.get("/scripts/{script_id}", response_model=ScriptResponse)
-async def get_script(script_id: str, db: Session = Depends(get_db)):
+async def get_script(script_id: str, db: AsyncSession = Depends(get_db)):
     """Get specific script"""
-    script = db.query(Script).filter(Script.id == script_id).first()
+    script = await db.get(Script, script_id, options=[selectinload(Script.scenes)])
     if not script:
         raise HTTPException(status_code=404, detail="Script not found")
     
-    return ScriptResponse(
-        id=script.id,
-        title=script.title,
-        content=script.content,
-        style=script.style,
-        parsed_data=script.parsed_data,
-        created_at=script.created_at
-    )
+    return _script_response(script, script.scenes)
+
+@api_router.put("/scripts/{script_id}", response_model=ScriptResponse)
+async def update_script(script_id: str, script_data: ScriptUpdate, db: AsyncSession = Depends(get_db)):
+    """Edit a script; scenes are matched by order so unchanged ones keep their panels"""
+    script = await db.get(Script, script_id, options=[selectinload(Script.scenes)])
+    if not script:
+        raise HTTPException(status_code=404, detail="Script not found")
+    
+    try:
+        reindex = False
+        if script_data.title is not None:
+            reindex = script_data.title != script.title
+            script.title = script_data.title
+        if script_data.style is not None:
+            script.style = script_data.style
+        if script_data.content is not None and script_data.content != script.content:
+            parsed_data = get_script_parser().parse_script(script_data.content)
+            script.content = script_data.content
+            kept, removed = merge_scenes(script.id, script.scenes, parsed_data)
+            for scene in removed:
+                await db.delete(scene)
+            script.scenes = kept
+            reindex = True
+        if reindex:
+            await index_scripts(db, [(script, script.scenes)], replace=True)
+        
+        await db.commit()
+        return _script_response(script, script.scenes)
+    
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error updating script: {str(e)}")
+
+def _batches(items: List[Any]):
+    """(index, item) batches of IMPORT_BATCH_SIZE"""
+    indexed = list(enumerate(items))
+    for start in range(0, len(indexed), IMPORT_BATCH_SIZE):
+        yield indexed[start:start + IMPORT_BATCH_SIZE]
+
+def _validated(batch, model):
+    """Split a batch into valid (index, model) pairs and per-item error results"""
+    valid, results = [], {}
+    for index, item in batch:
+        try:
+            if isinstance(item, Exception):
+                raise item
+            if not isinstance(item, dict):
+                raise ValueError("Expected a JSON object")
+            valid.append((index, model(**item)))
+        except (ValueError, TypeError) as e:
+            results[index] = {"index": index, "error": item_error(e)}
+    return valid, results
+
+async def _import_scripts(batch) -> List[Dict[str, Any]]:
+    """Parse one batch across the process pool and store it in one transaction"""
+    valid, results = _validated(batch, ScriptCreate)
+    
+    # One chunk per worker process keeps pickling overhead per batch, not per script
+    loop = asyncio.get_running_loop()
+    with span("bulk_import.parse", scripts=len(valid)):
+        chunks = await asyncio.gather(*[
+            loop.run_in_executor(get_process_pool(), parse_scripts, chunk)
+            for chunk in chunked([script_data.content for _, script_data in valid], pool_size())
+        ]) if valid else []
+    parsed = [item for chunk in chunks for item in chunk]
+    
+    created = []
+    async with AsyncSessionLocal() as db:
+        for (index, script_data), (parsed_data, error) in zip(valid, parsed):
+            if error:
+                results[index] = {"index": index, "title": script_data.title, "error": error}
+                continue
+            # Ids assigned up front so scenes need no flush per script
+            script = Script(id=str(uuid.uuid4()), title=script_data.title, content=script_data.content, style=script_data.style)
+            scenes = scenes_from_parsed(script.id, parsed_data)
+            db.add(script)
+            db.add_all(scenes)
+            created.append((index, script, scenes))
+        
+        try:
+            with span("bulk_import.commit", scripts=len(created)):
+                await index_scripts(db, [(script, scenes) for _, script, scenes in created])
+                await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Bulk script import batch failed: {str(e)}")
+            for index, script, _ in created:
+                results[index] = {"index": index, "title": script.title, "error": f"Error saving script: {str(e)}"}
+        else:
+            for index, script, scenes in created:
+                results[index] = {"index": index, "id": script.id, "title": script.title, "scene_count": len(scenes)}
+    
+    return [results[index] for index, _ in batch]
+
+@api_router.post("/scripts/bulk")
+async def bulk_import_scripts(request: BulkScriptImport):
+    """Parse and save many scripts; one result per item, in order"""
+    if len(request.scripts) > IMPORT_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {IMPORT_MAX_ITEMS} scripts per request; use /api/scripts/bulk/ndjson")
+    results = []
+    for batch in _batches(request.scripts):
+        results += await _import_scripts(batch)
+    return summarize(results)
+
+@api_router.post("/scripts/bulk/ndjson")
+async def bulk_import_scripts_ndjson(request: Request):
+    """Streamed import: one script object per line, stored batch by batch as it arrives"""
+    results = []
+    async for batch in ndjson_batches(request.stream()):
+        results += await _import_scripts(batch)
+    return summarize(results)
 
 # Character Management
+def _character_dict(character: Character) -> Dict[str, Any]:
+    return {
+        'id': character.id,
+        'name': character.name,
+        'description': character.description,
+        'tags': character.tags or [],
+        'image_ref': character.image_ref,
+        'created_at': character.created_at,
+    }
+
+async def _character_index() -> CharacterIndex:
+    """The character index, loaded from the database on first use and
+    reloaded after another worker process changed characters"""
+    global _character_index_version
+    index = get_character_index()
+    if not index.loaded or _character_index_version != await _shared_character_index_version():
+        async with _character_index_lock:
+            # Read before the scan: a change made during it triggers another reload
+            version = await _shared_character_index_version()
+            if not index.loaded or _character_index_version != version:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(select(Character))
+                    index.load(_character_dict(character) for character in result.scalars())
+                _character_index_version = version
+                logger.info(f"Loaded {len(index)} characters into the search index")
+    return index
+
+async def _shared_character_index_version() -> int:
+    return await run_in_threadpool(get_shared_cache().get, CHARACTER_INDEX_VERSION_KEY, 0)
+
+async def _character_index_changed():
+    """Tell other worker processes; call under _character_index_lock after updating the local index"""
+    global _character_index_version
+    # incr can wait up to the cache's busy timeout for another process's write
+    version = await run_in_threadpool(get_shared_cache().incr, CHARACTER_INDEX_VERSION_KEY)
+    # Nobody else changed anything since our last load: we're still current
+    if _character_index_version == version - 1:
+        _character_index_version = version
+
 @api_router.post("/characters", response_model=CharacterResponse)
-async def create_character(character_data: CharacterCreate, db: Session = Depends(get_db)):
+async def create_character(character_data: CharacterCreate, db: AsyncSession = Depends(get_db)):
     """Create new character"""
     character = Character(
         name=character_data.name,
@@ -176,184 +465,804 @@ async def create_character(character_data: CharacterCreate, db: Session = Depend
     )
     
     db.add(character)
-    db.commit()
-    db.refresh(character)
-    
-    return CharacterResponse(
-        id=character.id,
-        name=character.name,
-        description=character.description,
-        tags=character.tags or [],
-        image_ref=character.image_ref,
-        created_at=character.created_at
-    )
+    await db.commit()
+    await db.refresh(character)
+    
+    async with _character_index_lock:
+        get_character_index().add(_character_dict(character))
+        await _character_index_changed()
+    
+    return CharacterResponse(**_character_dict(character))
+
+async def _import_characters(batch) -> List[Dict[str, Any]]:
+    """Store one batch of characters in one transaction"""
+    valid, results = _validated(batch, CharacterCreate)
+    characters = [
+        (index, Character(
+            id=str(uuid.uuid4()),
+            name=character_data.name,
+            description=character_data.description,
+            tags=character_data.tags,
+            image_ref=character_data.image_ref
+        ))
+        for index, character_data in valid
+    ]
+    
+    async with AsyncSessionLocal() as db:
+        db.add_all([character for _, character in characters])
+        try:
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Bulk character import batch failed: {str(e)}")
+            for index, character in characters:
+                results[index] = {"index": index, "name": character.name, "error": f"Error saving character: {str(e)}"}
+        else:
+            async with _character_index_lock:
+                index = get_character_index()
+                for _, character in characters:
+                    index.add(_character_dict(character))
+                await _character_index_changed()
+            for position, character in characters:
+                results[position] = {"index": position, "id": character.id, "name": character.name}
+    
+    return [results[index] for index, _ in batch]
+
+@api_router.post("/characters/bulk")
+async def bulk_import_characters(request: BulkCharacterImport):
+    """Create many characters; one result per item, in order"""
+    if len(request.characters) > IMPORT_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {IMPORT_MAX_ITEMS} characters per request; use /api/characters/bulk/ndjson")
+    results = []
+    for batch in _batches(request.characters):
+        results += await _import_characters(batch)
+    return summarize(results)
+
+@api_router.post("/characters/bulk/ndjson")
+async def bulk_import_characters_ndjson(request: Request):
+    """Streamed import: one character object per line"""
+    results = []
+    async for batch in ndjson_batches(request.stream()):
+        results += await _import_characters(batch)
+    return summarize(results)
 
 @api_router.get("/characters", response_model=List[CharacterResponse])
-async def get_characters(db: Session = Depends(get_db)):
+async def get_characters(db: AsyncSession = Depends(get_db)):
     """Get all characters"""
-    characters = db.query(Character).order_by(Character.created_at.desc()).all()
-    return [CharacterResponse(
-        id=character.id,
-        name=character.name,
-        description=character.description,
-        tags=character.tags or [],
-        image_ref=character.image_ref,
-        created_at=character.created_at
-    ) for character in characters]
+    result = await db.execute(select(Character).order_by(Character.created_at.desc()))
+    characters = result.scalars().all()
+    return [CharacterResponse(**_character_dict(character)) for character in characters]
+
+@api_router.get("/characters/search", response_model=CharacterSearchResponse)
+async def search_characters(
+    q: Optional[str] = None,
+    tags: List[str] = Query([]),
+    match: str = "all",
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """Fuzzy name and tag search, ranked by name similarity"""
+    if match not in ("all", "any"):
+        raise HTTPException(status_code=400, detail="match must be 'all' or 'any'")
+    
+    # Accept both ?tags=a&tags=b and ?tags=a,b
+    tag_list = [tag.strip() for value in tags for tag in value.split(",") if tag.strip()]
+    index = await _character_index()
+    total, hits = index.search(q, tag_list, match_all_tags=match == "all", limit=limit, offset=offset)
+    return CharacterSearchResponse(
+        total=total,
+        results=[CharacterSearchResult(**character, score=score) for character, score in hits]
+    )
+
+@api_router.post("/characters/resolve")
+async def resolve_characters(request: CharacterResolveRequest, db: AsyncSession = Depends(get_db)):
+    """Match script character names to stored characters in one round trip"""
+    names = list(request.names)
+    if request.script_id:
+        script = await db.get(Script, request.script_id)
+        if not script:
+            raise HTTPException(status_code=404, detail="Script not found")
+        result = await db.execute(select(Scene).where(Scene.script_id == request.script_id).order_by(Scene.order))
+        names += parsed_data_from_scenes(result.scalars().all())['character_list']
+    
+    index = await _character_index()
+    resolved = index.resolve(dict.fromkeys(names))
+    return {
+        "resolved": {
+            name: {
+                "character": CharacterResponse(**match['character']) if match['character'] else None,
+                "score": match['score'],
+                "candidates": [
+                    CharacterSearchResult(**candidate['character'], score=candidate['score'])
+                    for candidate in match['candidates']
+                ],
+            }
+            for name, match in resolved.items()
+        },
+        "unresolved": [name for name, match in resolved.items() if match['character'] is None],
+    }
 
 @api_router.delete("/characters/{character_id}")
-async def delete_character(character_id: str, db: Session = Depends(get_db)):
+async def delete_character(character_id: str, db: AsyncSession = Depends(get_db)):
     """Delete character"""
-    character = db.query(Character).filter(Character.id == character_id).first()
+    character = await db.get(Character, character_id)
     if not character:
         raise HTTPException(status_code=404, detail="Character not found")
     
-    db.delete(character)
-    db.commit()
+    await db.delete(character)
+    await db.commit()
+    
+    async with _character_index_lock:
+        get_character_index().remove(character_id)
+        await _character_index_changed()
     return {"success": True}
 
 # Panel Generation
 @api_router.post("/generate/panel")
-async def generate_panel(scene_data: Dict[str, Any], style: str = "shounen"):
+async def generate_panel(scene_data: Dict[str, Any], http_request: Request, style: str = "shounen"):
     """Generate individual manga panel"""
+    admission.check_rate(client_id(http_request), "generate_panel")
+    reservation = admission.reserve(1, "generate_panel")
     try:
-        result = sd_generator.generate_panel(scene_data, style)
+        # SD and health-check calls block; keep them off the event loop
+        with GENERATIONS_IN_FLIGHT.track_inprogress():
+            result = await run_in_threadpool(get_sd_generator().generate_panel, scene_data, style)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating panel: {str(e)}")
+    finally:
+        reservation.close()
+
+async def _letter_panel_result(loop, panel_result: Dict[str, Any], dialogue: List[Any]) -> Dict[str, Any]:
+    """Replace a generated panel's image with a lettered copy, keeping the clean art"""
+    name = get_image_store().name_from_url(panel_result['image_url'])
+    if not name:
+        return panel_result
+    
+    try:
+        with span("letter_panel", image=name), stage_timer("letter_panel"):
+            lettered_url = await loop.run_in_executor(
+                get_process_pool(), letter_panel, name, dialogue
+            )
+    except Exception as e:
+        logging.error(f"Error lettering panel {name}: {str(e)}")
+        return panel_result
+    
+    metadata = dict(panel_result.get('generation_metadata') or {})
+    metadata['raw_image_url'] = panel_result['image_url']
+    return {**panel_result, 'image_url': lettered_url, 'generation_metadata': metadata}
+
+def _with_character_refs(scene_data: Dict[str, Any], resolved: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Scene data whose characters carry the stored character's image_ref (and description if missing)"""
+    characters = []
+    for char in scene_data.get('characters') or []:
+        stored = (resolved.get(char.get('name')) or {}).get('character')
+        if stored:
+            char = {
+                **char,
+                'description': char.get('description') or stored['description'],
+                'image_ref': char.get('image_ref') or stored['image_ref'],
+            }
+        characters.append(char)
+    return {**scene_data, 'characters': characters}
+
+def _panel_render(mode: str, scene: Scene, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Render settings for one panel of a standard, draft or final job"""
+    if mode == 'draft':
+        # A fixed seed per scene (or the caller's) so the final pass can reproduce it
+        seed = options.get('seed')
+        return {'mode': 'draft', 'seed': int(seed) if seed is not None else zlib.crc32(scene.id.encode()) & 0x7fffffff}
+    if mode == 'final':
+        draft = options['drafts'][scene.id]
+        return {'mode': 'final', 'method': options.get('method', 'hires'), 'seed': draft['render']['seed'], 'draft': draft['render']}
+    return {}
+
+async def _scene_panels(db: AsyncSession, scenes: List[Scene]) -> Dict[str, List[Panel]]:
+    """Every panel of each scene, oldest first; the last is the one export and pages show"""
+    if not scenes:
+        return {}
+    result = await db.execute(
+        select(Panel).where(Panel.scene_id.in_([scene.id for scene in scenes])).order_by(Panel.created_at)
+    )
+    panels: Dict[str, List[Panel]] = {}
+    for panel in result.scalars():
+        panels.setdefault(panel.scene_id, []).append(panel)
+    return panels
+
+def _reusable_panel(panels: List[Panel], fingerprint: str, lettering_key: Optional[str]) -> Optional[Panel]:
+    """Newest real panel with this fingerprint, preferring one lettered with the same dialogue"""
+    matching = [
+        panel for panel in panels
+        if panel.fingerprint == fingerprint and not (panel.generation_metadata or {}).get('fallback')
+    ]
+    lettered = [panel for panel in matching if (panel.generation_metadata or {}).get('lettering_key') == lettering_key]
+    return (lettered or matching or [None])[-1]
+
+def _lettering_key(dialogue: List[Any]) -> str:
+    """Hash of the dialogue lettered onto a panel"""
+    return hashlib.sha256(json.dumps(dialogue, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def _reused_panel_result(panel: Panel) -> Dict[str, Any]:
+    """A stored panel's clean art, shaped like a generate_panel result"""
+    metadata = dict(panel.generation_metadata or {})
+    image_url = metadata.pop('raw_image_url', None) or panel.image_url
+    metadata.pop('lettering_key', None)
+    metadata['reused_panel_id'] = panel.id
+    return {'image_url': image_url, 'prompt_used': panel.prompt_used, 'generation_metadata': metadata}
 
 # Background task for manga generation
-async def generate_manga_task(job_id: str, script_id: str, style: str, db_session):
+async def generate_manga_task(job_id: str, script_id: str, style: str, options: Optional[Dict[str, Any]] = None,
+                              reservation: Optional[Reservation] = None):
     """Background task to generate full manga"""
-    try:
-        # Get job and script
-        job = db_session.query(GenerationJob).filter(GenerationJob.id == job_id).first()
-        script = db_session.query(Script).filter(Script.id == script_id).first()
-        
-        if not job or not script:
-            return
-        
-        # Update job status
-        job.status = "processing"
-        db_session.commit()
-        
-        # Get scenes
-        scenes = db_session.query(Scene).filter(Scene.script_id == script_id).order_by(Scene.order).all()
-        job.total_panels = len(scenes)
-        db_session.commit()
-        
-        generated_panels = []
-        
-        # Generate each panel
-        for i, scene in enumerate(scenes):
+    # Picked up by the event loop: no longer waiting in the queue
+    JOBS_QUEUED.dec()
+    panels_pending = 0
+    # The request's session is closed once the response is sent, so the
+    # task works in a session of its own
+    with span("generate_manga", job_id=job_id, script_id=script_id, style=style):
+        async with AsyncSessionLocal() as db_session:
+            job = None
             try:
-                scene_data = {
-                    'id': scene.id,
-                    'characters': scene.characters,
-                    'actions': scene.action.split(', ') if scene.action else [],
-                    'dialogue': [{'text': d} for d in scene.dialogue] if scene.dialogue else [],
-                    'location': scene.location,
-                    'mood': scene.mood,
-                    'scene_type': scene.scene_type
-                }
+                # Get job and script
+                job = await db_session.get(GenerationJob, job_id)
+                script = await db_session.get(Script, script_id)
                 
-                # Generate panel
-                panel_result = sd_generator.generate_panel(scene_data, style)
+                if not job or not script:
+                    return
                 
-                # Save panel record
-                panel = Panel(
-                    scene_id=scene.id,
-                    image_url=panel_result['image_url'],
-                    prompt_used=panel_result['prompt_used'],
-                    generation_metadata=panel_result.get('generation_metadata', {})
+                # Get scenes
+                result = await db_session.execute(
+                    select(Scene).where(Scene.script_id == script_id).order_by(Scene.order)
                 )
+                scenes = result.scalars().all()
+                
+                # A final pass only re-renders the approved drafts' scenes;
+                # a single-scene regeneration only that scene
+                mode = (options or {}).get('mode', 'standard')
+                drafts = (options or {}).get('drafts') or {}
+                if mode == 'final':
+                    scenes = [scene for scene in scenes if scene.id in drafts]
+                if (options or {}).get('scene_ids'):
+                    scenes = [scene for scene in scenes if scene.id in options['scene_ids']]
+                
+                # Kept as plain values: a failed panel's rollback expires every loaded object
+                scene_ids = [scene.id for scene in scenes]
                 
-                db_session.add(panel)
-                generated_panels.append({
-                    'panel_id': panel.id,
-                    'scene_id': scene.id,
-                    'image_url': panel_result['image_url'],
-                    'prompt': panel_result['prompt_used']
-                })
+                # Update job status
+                job.status = "processing"
+                job.total_panels = len(scenes)
+                await db_session.commit()
+                panels_pending = len(scenes)
+                PANELS_QUEUED.inc(panels_pending)
                 
-                # Update progress
-                job.completed_panels = i + 1
-                job.progress = (i + 1) / len(scenes)
-                db_session.commit()
+                # Link script characters to stored ones once per job, for reference images
+                index = await _character_index()
+                resolved = index.resolve(parsed_data_from_scenes(scenes)['character_list'])
                 
-                # Small delay to prevent overwhelming the system
-                await asyncio.sleep(1)
+                # Scenes with a panel whose fingerprint matches their effective
+                # prompt and settings reuse its art (any such panel: a draft or
+                # final pass in between doesn't make a standard render stale)
+                scene_panels = {} if (options or {}).get('force') else await _scene_panels(db_session, scenes)
+                reused_panels = 0
+                
+                panel_count = 0
+                # Drafts are for checking composition; letter them only on request
+                lettering_enabled = (options or {}).get('lettering', mode != 'draft')
+                loop = asyncio.get_running_loop()
+                
+                # Generate each panel
+                for i, (scene, scene_id) in enumerate(zip(scenes, scene_ids)):
+                    with span("panel", index=i, scene_id=scene_id):
+                        try:
+                            scene_data = _with_character_refs(scene_generation_data(scene), resolved)
+                            render = _panel_render(mode, scene, options or {})
+                            fingerprint = get_sd_generator().fingerprint(scene_data, style, render)
+                            lettering_key = _lettering_key(scene.dialogue) if lettering_enabled and scene.dialogue else None
+                            
+                            panels = scene_panels.get(scene.id, [])
+                            previous = _reusable_panel(panels, fingerprint, lettering_key)
+                            same_text = previous is not None and \
+                                (previous.generation_metadata or {}).get('lettering_key') == lettering_key
+                            if same_text and previous is panels[-1]:
+                                # Nothing changed: the existing panel is this job's panel
+                                panel_id = previous.id
+                                reused_panels += 1
+                            else:
+                                if same_text:
+                                    # An older panel has this exact art and text: copy it,
+                                    # so it is the scene's current panel again
+                                    panel_result = {
+                                        'image_url': previous.image_url,
+                                        'prompt_used': previous.prompt_used,
+                                        'generation_metadata': {
+                                            **(previous.generation_metadata or {}), 'reused_panel_id': previous.id
+                                        }
+                                    }
+                                    reused_panels += 1
+                                elif previous is not None:
+                                    # Same art, different dialogue: re-letter the clean image, no SD call
+                                    panel_result = _reused_panel_result(previous)
+                                    reused_panels += 1
+                                else:
+                                    # Generate panel (blocking HTTP + PIL work, so in a thread)
+                                    with GENERATIONS_IN_FLIGHT.track_inprogress():
+                                        panel_result = await run_in_threadpool(
+                                            get_sd_generator().generate_panel, scene_data, style, render
+                                        )
+                                
+                                # Letter dialogue onto the art in a worker process
+                                if lettering_key and not same_text:
+                                    panel_result = await _letter_panel_result(loop, panel_result, scene.dialogue)
+                                
+                                metadata = dict(panel_result.get('generation_metadata') or {})
+                                if lettering_key and 'raw_image_url' in metadata:
+                                    metadata['lettering_key'] = lettering_key
+                                if mode == 'final':
+                                    metadata['draft_panel_id'] = drafts[scene.id]['panel_id']
+                                
+                                # Save panel record; placeholders get no fingerprint so they are retried
+                                panel = Panel(
+                                    scene_id=scene.id,
+                                    image_url=panel_result['image_url'],
+                                    prompt_used=panel_result['prompt_used'],
+                                    generation_metadata=metadata,
+                                    fingerprint=None if panel_result.get('error') or metadata.get('fallback') else fingerprint
+                                )
+                                
+                                db_session.add(panel)
+                                await db_session.flush()
+                                panel_id = panel.id
+                            # One small row per result instead of a list rewritten on every commit
+                            db_session.add(JobPanel(job_id=job_id, position=panel_count, panel_id=panel_id))
+                            
+                            # Update progress
+                            job.completed_panels = i + 1
+                            job.progress = (i + 1) / len(scenes)
+                            with span("db.commit"), stage_timer("panel_commit"):
+                                await db_session.commit()
+                            panel_count += 1
+                            
+                            # Small delay to prevent overwhelming the system
+                            if previous is None:
+                                await asyncio.sleep(1)
+                            
+                        except Exception as e:
+                            await db_session.rollback()
+                            logging.error(f"Error generating panel for scene {scene_id}: {str(e)}")
+                            # Load the expired job, scenes and panels again: the async
+                            # session can't lazy-load them when the next scene reads them
+                            await db_session.refresh(job)
+                            await db_session.execute(select(Scene).where(Scene.id.in_(scene_ids)))
+                            if scene_panels:
+                                scene_panels = await _scene_panels(db_session, scenes)
+                            continue
+                        finally:
+                            panels_pending -= 1
+                            PANELS_QUEUED.dec()
+                            if reservation is not None:
+                                reservation.release()
+                    
+                # Complete job
+                job.status = "completed"
+                job.progress = 1.0
+                job.result_data = {"reused_panels": reused_panels}
+                await db_session.commit()
                 
             except Exception as e:
-                logging.error(f"Error generating panel for scene {scene.id}: {str(e)}")
-                continue
-        
-        # Complete job
-        job.status = "completed"
-        job.progress = 1.0
-        job.result_data = {"panels": generated_panels}
-        db_session.commit()
-        
-    except Exception as e:
-        # Mark job as failed
-        job.status = "failed"
-        job.error_message = str(e)
-        db_session.commit()
-        logging.error(f"Error in manga generation task: {str(e)}")
-    finally:
-        db_session.close()
+                # Mark job as failed
+                await db_session.rollback()
+                if job is not None:
+                    job.status = "failed"
+                    job.error_message = str(e)
+                    await db_session.commit()
+                logging.error(f"Error in manga generation task: {str(e)}")
+            finally:
+                if panels_pending:
+                    PANELS_QUEUED.dec(panels_pending)
+                if reservation is not None:
+                    reservation.close()
+
+async def _queue_generation_job(
+    db: AsyncSession,
+    background_tasks: BackgroundTasks,
+    script_id: str,
+    style: str,
+    options: Dict[str, Any],
+    panels: int,
+    endpoint: str
+) -> GenerationJob:
+    """Admit `panels` against the budget, create the job and start it in the background"""
+    reservation = admission.reserve(panels, endpoint)
+    try:
+        job = GenerationJob(
+            script_id=script_id,
+            status="pending"
+        )
+        db.add(job)
+        await db.commit()
+    except Exception:
+        reservation.close()
+        raise
+    
+    JOBS_QUEUED.inc()
+    background_tasks.add_task(generate_manga_task, job.id, script_id, style, options, reservation)
+    return job
 
 @api_router.post("/generate/manga")
 async def start_manga_generation(
     request: GenerationRequest, 
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_db)
 ):
     """Start full manga generation job"""
+    admission.check_rate(client_id(http_request), "generate_manga")
+    if request.options.get('mode', 'standard') not in ('standard', 'draft'):
+        raise HTTPException(status_code=400, detail="options.mode must be 'standard' or 'draft'")
+    
     # Verify script exists
-    script = db.query(Script).filter(Script.id == request.script_id).first()
+    script = await db.get(Script, request.script_id)
     if not script:
         raise HTTPException(status_code=404, detail="Script not found")
     
-    # Create generation job
-    job = GenerationJob(
-        script_id=request.script_id,
-        status="pending"
+    # Every scene counts against the panel budget until it is done
+    scene_count = await db.scalar(select(func.count(Scene.id)).where(Scene.script_id == request.script_id))
+    job = await _queue_generation_job(
+        db, background_tasks, request.script_id, request.style, request.options, scene_count, "generate_manga"
     )
     
-    db.add(job)
-    db.commit()
-    db.refresh(job)
+    return {
+        "job_id": job.id,
+        "status": "started",
+        "message": "Manga generation started in background"
+    }
+
+@api_router.post("/scripts/{script_id}/scenes/{order}/regenerate")
+async def regenerate_scene(
+    script_id: str,
+    order: int,
+    background_tasks: BackgroundTasks,
+    http_request: Request,
+    request: Optional[SceneRegenerationRequest] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Render one scene again, even if its fingerprint is unchanged"""
+    admission.check_rate(client_id(http_request), "regenerate_scene")
+    request = request or SceneRegenerationRequest()
+    if request.options.get('mode', 'standard') not in ('standard', 'draft'):
+        raise HTTPException(status_code=400, detail="options.mode must be 'standard' or 'draft'")
+    script = await db.get(Script, script_id)
+    if not script:
+        raise HTTPException(status_code=404, detail="Script not found")
+    result = await db.execute(select(Scene.id).where(Scene.script_id == script_id, Scene.order == order))
+    scene_id = result.scalar_one_or_none()
+    if not scene_id:
+        raise HTTPException(status_code=404, detail="Scene not found")
     
-    # Start background task
-    background_tasks.add_task(generate_manga_task, job.id, request.script_id, request.style, db)
+    options = {'force': True, **request.options, 'scene_ids': [scene_id]}
+    job = await _queue_generation_job(
+        db, background_tasks, script_id, request.style or script.style, options, 1, "regenerate_scene"
+    )
     
     return {
         "job_id": job.id,
         "status": "started",
-        "message": "Manga generation started in background"
+        "message": "Scene regeneration started in background"
+    }
+
+@api_router.post("/generate/final")
+async def start_final_generation(
+    request: FinalGenerationRequest,
+    background_tasks: BackgroundTasks,
+    http_request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """Re-render approved draft panels at full quality, reusing each draft's seed"""
+    admission.check_rate(client_id(http_request), "generate_final")
+    if request.method not in FINAL_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(FINAL_METHODS)}")
+    script = await db.get(Script, request.script_id)
+    if not script:
+        raise HTTPException(status_code=404, detail="Script not found")
+    
+    result = await db.execute(
+        select(Panel.id, Panel.scene_id, Panel.image_url, Panel.generation_metadata)
+        .join(Scene, Panel.scene_id == Scene.id)
+        .where(Scene.script_id == request.script_id, Panel.id.in_(request.panel_ids))
+    )
+    drafts = {}
+    for row in result.all():
+        metadata = row.generation_metadata or {}
+        render = metadata.get('render') or {}
+        if render.get('mode') != 'draft':
+            continue
+        if row.scene_id in drafts:
+            raise HTTPException(status_code=400, detail="Approve at most one draft per scene")
+        # img2img starts from the clean draft art, not a lettered copy
+        image_name = get_image_store().name_from_url(metadata.get('raw_image_url') or row.image_url)
+        drafts[row.scene_id] = {'panel_id': row.id, 'render': {**render, 'image': image_name}}
+    
+    found = {draft['panel_id'] for draft in drafts.values()}
+    missing = [panel_id for panel_id in request.panel_ids if panel_id not in found]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Not draft panels of this script: {', '.join(missing)}")
+    
+    options = {**request.options, 'mode': 'final', 'method': request.method, 'drafts': drafts}
+    job = await _queue_generation_job(
+        db, background_tasks, request.script_id, request.style or script.style, options, len(drafts), "generate_final"
+    )
+    
+    return {
+        "job_id": job.id,
+        "status": "started",
+        "panels": len(drafts),
+        "message": "Final render started in background"
     }
 
 @api_router.get("/generate/status/{job_id}", response_model=GenerationStatusResponse)
-async def get_generation_status(job_id: str, db: Session = Depends(get_db)):
-    """Get manga generation status"""
-    job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+async def get_generation_status(
+    job_id: str,
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, le=1000),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get manga generation status with the panel results from index `since` on"""
+    job = await db.get(GenerationJob, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
+    panel_count = await db.scalar(select(func.count()).select_from(JobPanel).where(JobPanel.job_id == job_id))
+    panels = await _job_panels(db, job_id, since, limit) if limit else []
+    result_data = job.result_data
+    legacy = (result_data or {}).get('panels')
+    if not panel_count and isinstance(legacy, list):
+        # Jobs whose old panel summaries couldn't be matched to panel rows;
+        # the full list is only sent a page at a time
+        panel_count = len(legacy)
+        panels = [{**panel, 'index': index} for index, panel in enumerate(legacy[since:since + limit], since)]
+        result_data = {key: value for key, value in result_data.items() if key != 'panels'}
+    
     return GenerationStatusResponse(
         id=job.id,
         status=job.status,
         progress=job.progress or 0.0,
         total_panels=job.total_panels,
         completed_panels=job.completed_panels or 0,
-        result_data=job.result_data,
-        error_message=job.error_message
+        result_data=result_data,
+        error_message=job.error_message,
+        panel_count=panel_count,
+        panels=panels,
+        next_since=panels[-1]['index'] + 1 if panels else since
+    )
+
+async def _job_panels(db: AsyncSession, job_id: str, since: int, limit: int) -> List[Dict[str, Any]]:
+    """A page of a job's panel results, in the order they were generated"""
+    result = await db.execute(
+        select(JobPanel.position, Panel.id, Panel.scene_id, Panel.image_url, Panel.prompt_used)
+        .join(Panel, Panel.id == JobPanel.panel_id)
+        .where(JobPanel.job_id == job_id, JobPanel.position >= since)
+        .order_by(JobPanel.position)
+        .limit(limit)
+    )
+    return [
+        {
+            'index': row.position,
+            'panel_id': row.id,
+            'scene_id': row.scene_id,
+            'image_url': row.image_url,
+            'prompt': row.prompt_used
+        }
+        for row in result.all()
+    ]
+
+# Export & Download
+async def _latest_panels(db: AsyncSession, script_id: str) -> List[Dict[str, Any]]:
+    """Newest panel of every scene, in script order, with its stored image name"""
+    result = await db.execute(
+        select(Scene.order, Scene.scene_type, Scene.mood, Panel.id, Panel.scene_id, Panel.image_url)
+        .join(Panel, Panel.scene_id == Scene.id)
+        .where(Scene.script_id == script_id)
+        .order_by(Scene.order, Panel.created_at.desc())
+    )
+    rows = result.all()
+    
+    panels = []
+    seen_orders = set()
+    for order, scene_type, mood, panel_id, scene_id, image_url in rows:
+        if order in seen_orders:
+            continue
+        seen_orders.add(order)
+        name = get_image_store().name_from_url(image_url)
+        if name:
+            panels.append({
+                'panel_id': panel_id,
+                'scene_id': scene_id,
+                'scene_type': scene_type,
+                'mood': mood,
+                'name': name
+            })
+    return panels
+
+@api_router.get("/export/manga/{script_id}")
+async def export_manga(script_id: str, format: str = "zip", db: AsyncSession = Depends(get_db)):
+    """Stream the finished manga as a ZIP of panel images or a multi-page PDF"""
+    if format not in ("zip", "pdf"):
+        raise HTTPException(status_code=400, detail="Export format must be 'zip' or 'pdf'")
+    
+    script = await db.get(Script, script_id)
+    if not script:
+        raise HTTPException(status_code=404, detail="Script not found")
+    
+    # Only the (small) list of names is resolved up front; image contents
+    # are read and sent chunk by chunk while the client downloads.
+    names = [panel['name'] for panel in await _latest_panels(db, script_id)]
+    if not names:
+        raise HTTPException(status_code=404, detail="No generated panels to export")
+    
+    safe_title = re.sub(r'[^A-Za-z0-9_.-]+', '_', script.title).strip('_') or "manga"
+    if format == "pdf":
+        body = stream_pdf(get_image_store(), names, title=script.title)
+        media_type = "application/pdf"
+    else:
+        width = len(str(len(names)))
+        entries = (
+            (f"{safe_title}/panel_{str(i + 1).zfill(width)}{Path(name).suffix}", name)
+            for i, name in enumerate(names)
+        )
+        body = stream_zip(get_image_store(), entries)
+        media_type = "application/zip"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{safe_title}.{format}"'}
+    )
+
+# Page Composition
+@api_router.post("/compose/pages/{script_id}")
+async def compose_pages(script_id: str, gutter: int = 20, border: int = 4, db: AsyncSession = Depends(get_db)):
+    """Lay out the script's panels into manga pages"""
+    script = await db.get(Script, script_id)
+    if not script:
+        raise HTTPException(status_code=404, detail="Script not found")
+    
+    panels = await _latest_panels(db, script_id)
+    if not panels:
+        raise HTTPException(status_code=404, detail="No generated panels to compose")
+    
+    plans = plan_pages(panels, gutter=max(gutter, 0), border=max(border, 0))
+    
+    # Pages are independent, so they render in parallel across processes
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        pages = await asyncio.gather(*[
+            loop.run_in_executor(pool, render_page, plan)
+            for plan in plans
+        ])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error composing pages: {str(e)}")
+    
+    return {"script_id": script_id, "total_pages": len(pages), "pages": pages}
+
+# Lettering
+@api_router.post("/letter/script/{script_id}")
+async def letter_script(script_id: str, db: AsyncSession = Depends(get_db)):
+    """(Re)draw dialogue bubbles on the newest panel of every scene"""
+    script = await db.get(Script, script_id)
+    if not script:
+        raise HTTPException(status_code=404, detail="Script not found")
+    
+    panel_ids = [panel['panel_id'] for panel in await _latest_panels(db, script_id)]
+    result = await db.execute(
+        select(Panel, Scene.dialogue)
+        .join(Scene, Panel.scene_id == Scene.id)
+        .where(Panel.id.in_(panel_ids))
     )
+    rows = result.all()
+    
+    loop = asyncio.get_running_loop()
+    work = []
+    for panel, dialogue in rows:
+        if not dialogue:
+            continue
+        # Always letter the clean art so re-lettering doesn't stack bubbles
+        metadata = panel.generation_metadata or {}
+        source = {'image_url': metadata.get('raw_image_url', panel.image_url), 'generation_metadata': metadata}
+        work.append((panel, _letter_panel_result(loop, source, dialogue)))
+    
+    results = await asyncio.gather(*[coroutine for _, coroutine in work])
+    for (panel, _), lettered in zip(work, results):
+        panel.image_url = lettered['image_url']
+        panel.generation_metadata = lettered['generation_metadata']
+    await db.commit()
+    
+    return {
+        "script_id": script_id,
+        "lettered_panels": len(work),
+        "panels": [{"panel_id": panel.id, "image_url": panel.image_url} for panel, _ in work]
+    }
+
+# Image Uploads
+UPLOAD_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+
+@api_router.post("/images")
+async def upload_image(file: UploadFile = File(...)):
+    """Store an uploaded image (e.g. a character reference) and return its URL"""
+    ext = UPLOAD_EXTENSIONS.get(file.content_type)
+    if ext is None:
+        raise HTTPException(status_code=415, detail="Upload must be a PNG, JPEG or WebP image")
+    
+    # Streamed from the spooled upload into the store; multipart for object stores
+    image_store = get_image_store()
+    name = await run_in_threadpool(image_store.save_stream, file.file, "upload", ext)
+    return {"image_url": image_store.url_for(name)}
+
+# Storage Maintenance
+@api_router.get("/admin/gc")
+async def get_gc_stats():
+    """Image garbage collection counters"""
+    return {**get_image_gc().stats, "quota_bytes": get_image_gc().quota_bytes}
+
+@api_router.post("/admin/gc/run")
+async def run_gc():
+    """Run one garbage collection pass now"""
+    return await get_image_gc().run_once()
+
+@api_router.get("/admin/admission")
+async def get_admission_stats():
+    return admission.stats()
+
+@api_router.get("/admin/coalescing")
+async def get_coalescing_stats():
+    """Panel generations shared between identical concurrent requests"""
+    return get_sd_generator().in_flight.stats()
+
+@api_router.post("/admin/profile")
+async def run_profile(seconds: float = 10, job_id: Optional[str] = None, interval_ms: float = 5, format: str = "collapsed"):
+    """Sample every thread for N seconds, or until a job finishes; returns collapsed stacks"""
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail="Profile format must be 'collapsed' or 'json'")
+    if getattr(app.state, 'profiler', None) is not None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    
+    limit = min(seconds if job_id is None else MAX_PROFILE_SECONDS, MAX_PROFILE_SECONDS)
+    # Claimed before the first await, so a concurrent request sees it and gets the 409
+    profiler = SamplingProfiler(interval=interval_ms / 1000)
+    app.state.profiler = profiler
+    try:
+        if job_id is not None:
+            async with AsyncSessionLocal() as db:
+                if not await db.get(GenerationJob, job_id):
+                    raise HTTPException(status_code=404, detail="Job not found")
+        
+        profiler.start()
+        deadline = asyncio.get_running_loop().time() + max(limit, 0)
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.5)
+            if job_id is not None and await _job_finished(job_id):
+                break
+    finally:
+        await run_in_threadpool(profiler.stop)
+        app.state.profiler = None
+    
+    if format == "json":
+        return {**profiler.summary(), "job_id": job_id, "stacks": dict(profiler.samples.most_common())}
+    return PlainTextResponse(profiler.collapsed(), headers={"X-Profile-Samples": str(profiler.sample_count)})
+
+async def _job_finished(job_id: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        job = await db.get(GenerationJob, job_id)
+        return job is None or job.status in ("completed", "failed")
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return metrics_response()
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -361,6 +1270,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestLatencyMiddleware)
+if TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -368,3 +1280,4 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+
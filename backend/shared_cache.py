@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from functools import lru_cache
+from typing import Any, Optional
+
+# One file per host; every worker process opens it. It only holds
+# short-lived state (health, leases, versions), so /tmp is fine.
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH') or os.path.join(tempfile.gettempdir(), 'manga_shared_cache.db')
+
+# Expired keys are deleted every this many writes with a TTL
+PURGE_EVERY = 1000
+
+_MISSING = object()
+
+
+class SharedCache:
+    """Small key-value store shared by the worker processes of one host.
+
+    A SQLite file in WAL mode with synchronous=OFF: readers never block
+    each other or the writer, and an operation is tens of microseconds of
+    local I/O with no server to run. Meant for flags, counters, leases and
+    small results, not bulk data. Values are JSON; keys may expire.
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._expiring_writes = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections belong to one thread, and must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+        if ttl:
+            self._expiring_writes += 1
+            if self._expiring_writes % PURGE_EVERY == 0:
+                self.purge_expired()
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set key only if it is absent or expired; True if this call set it"""
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+            (key, json.dumps(value), now + ttl if ttl else None, now)
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key: str, value: Any = _MISSING):
+        """Remove key; with `value`, only while it still holds that value (e.g. a lease token)"""
+        if value is _MISSING:
+            self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+        else:
+            self._conn().execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, json.dumps(value)))
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        """Atomically add to an integer key (missing counts as 0); returns the new value"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, NULL) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + ?",
+                (key, str(amount), amount)
+            )
+            value = int(conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def purge_expired(self) -> int:
+        return self._conn().execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def clear(self):
+        self._conn().execute("DELETE FROM kv")
+
+
+@lru_cache(maxsize=None)
+def get_shared_cache() -> SharedCache:
+    return SharedCache()
@@ -0,0 +1,143 @@
+import copy
+import time
+import uuid
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import COALESCED_CALLS, COALESCED_SECONDS_SAVED
+from shared_cache import SharedCache
+
+# How long other processes wait for a shared call's result before
+# starting their own; must outlast the slowest call
+LEASE_SECONDS = 120
+# Results are kept just long enough for waiting processes to pick them up
+RESULT_SECONDS = 30
+POLL_SECONDS = (0.02, 0.5)
+
+_MISSING = object()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters", "seconds")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.seconds = 0.0
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key
+    wait for it and get (a copy of) its result instead of repeating the work.
+
+    Nothing is cached: once the call returns, the next caller starts anew.
+    With a shared cache, the first caller in each process also takes a
+    lease there, so callers in other worker processes on the host wait for
+    it too; results then have to be JSON-serialisable.
+    """
+
+    def __init__(self, name: str, shared: Optional[SharedCache] = None, lease_seconds: float = LEASE_SECONDS):
+        self.name = name
+        self.shared = shared
+        self.lease_seconds = lease_seconds
+        self.calls = 0
+        self.coalesced = 0
+        self.seconds_saved = 0.0
+        self._in_flight: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._coalesced_metric = COALESCED_CALLS.labels(name)
+        self._saved_metric = COALESCED_SECONDS_SAVED.labels(name)
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """func()'s result, and whether it came from another caller's call"""
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._in_flight[key] = _Call()
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # call.result is a snapshot taken before the leader's caller saw it
+            return copy.deepcopy(call.result), True
+
+        started = time.perf_counter()
+        result = None
+        try:
+            result, shared = self._call(key, func)
+            return result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            call.seconds = time.perf_counter() - started
+            with self._lock:
+                del self._in_flight[key]
+                waiters = call.waiters
+                self.coalesced += waiters
+                # Each waiter would otherwise have spent about as long itself
+                self.seconds_saved += waiters * call.seconds
+            if waiters:
+                call.result = copy.deepcopy(result)
+                self._coalesced_metric.inc(waiters)
+                self._saved_metric.inc(waiters * call.seconds)
+            call.done.set()
+
+    def _call(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """func() under the host-wide lease, or another process's result for key"""
+        if self.shared is None:
+            return func(), False
+        lease = f"flight:{self.name}:{key}"
+        token = uuid.uuid4().hex
+        while True:
+            if self.shared.add(lease, token, ttl=self.lease_seconds):
+                started = time.perf_counter()
+                try:
+                    result = func()
+                    self.shared.set(f"{lease}:{token}", {
+                        "result": result, "seconds": time.perf_counter() - started
+                    }, ttl=RESULT_SECONDS)
+                    return result, False
+                finally:
+                    self.shared.delete(lease, token)
+
+            owner = self.shared.get(lease)
+            if owner is None:
+                continue  # released between add and get
+            shared = self._wait(lease, owner)
+            if shared is not _MISSING:
+                with self._lock:
+                    self.coalesced += 1
+                    self.seconds_saved += shared["seconds"]
+                self._coalesced_metric.inc()
+                self._saved_metric.inc(shared["seconds"])
+                return shared["result"], True
+            # The owner failed or died without a result: take over
+
+    def _wait(self, lease: str, owner: str) -> Any:
+        """Poll until the owner of a lease publishes its result or gives the lease up"""
+        delay = POLL_SECONDS[0]
+        while True:
+            shared = self.shared.get(f"{lease}:{owner}", _MISSING)
+            if shared is not _MISSING or self.shared.get(lease) != owner:
+                # Published just before releasing, so one more look settles it
+                return shared if shared is not _MISSING else self.shared.get(f"{lease}:{owner}", _MISSING)
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_SECONDS[1])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+                "seconds_saved": round(self.seconds_saved, 3),
+            }
@@ -1,18 +1,60 @@
 import requests
 import base64
+import hashlib
 import io
+import json
 from PIL import Image
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 import os
-from pathlib import Path
+from image_store import ImageStore, get_image_store
+from reference_images import ReferenceImageCache
+from single_flight import SingleFlight
+from shared_cache import SharedCache, get_shared_cache
+from metrics import timed_stage, FALLBACK_IMAGES, SD_ERRORS
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
+# Switching checkpoints loads several GB; allow for a slow disk
+SD_WARMUP_TIMEOUT = float(os.environ.get('SD_WARMUP_TIMEOUT_SECONDS', 300))
+# Character reference images are sent as ControlNet units (one per character)
+SD_REFERENCE_ENABLED = os.environ.get('SD_REFERENCE_ENABLED', 'true').lower() == 'true'
+SD_REFERENCE_MODULE = os.environ.get('SD_REFERENCE_MODULE', 'reference_only')
+SD_REFERENCE_WEIGHT = float(os.environ.get('SD_REFERENCE_WEIGHT', 0.8))
+SD_MAX_REFERENCES = int(os.environ.get('SD_MAX_REFERENCES', 3))
+# Identical panel requests arriving while one is rendering share its result
+SD_COALESCE_ENABLED = os.environ.get('SD_COALESCE_ENABLED', 'true').lower() == 'true'
+# How long one health check answers for every worker on the host
+SD_HEALTH_TTL = float(os.environ.get('SD_HEALTH_TTL_SECONDS', 5))
+
+# Full-quality panel size (manga panel aspect ratio) and sampling steps
+PANEL_WIDTH, PANEL_HEIGHT, PANEL_STEPS = 512, 768, 20
+# Draft previews: a fraction of the size, few steps and a fixed seed, so an
+# approved draft can be re-rendered at full quality with the same composition
+DRAFT_SCALE = float(os.environ.get('DRAFT_SCALE', 0.5))
+DRAFT_STEPS = int(os.environ.get('DRAFT_STEPS', 8))
+# How far the final pass may move away from the draft (img2img / hires second pass)
+FINAL_DENOISING_STRENGTH = float(os.environ.get('FINAL_DENOISING_STRENGTH', 0.5))
+SD_HIRES_UPSCALER = os.environ.get('SD_HIRES_UPSCALER', 'Latent')
+RENDER_MODES = ("standard", "draft", "final")
+FINAL_METHODS = ("hires", "img2img")
+
+
+def draft_size() -> Tuple[int, int]:
+    """Draft width and height, rounded down to the multiple of 8 SD needs"""
+    return (max(64, int(PANEL_WIDTH * DRAFT_SCALE) // 8 * 8),
+            max(64, int(PANEL_HEIGHT * DRAFT_SCALE) // 8 * 8))
+
+def _normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
 class StableDiffusionGenerator:
     """Interface for Stable Diffusion image generation"""
     
-    def __init__(self, api_url: str = "http://127.0.0.1:7860"):
+    def __init__(self, api_url: str = "http://127.0.0.1:7860", image_store: Optional[ImageStore] = None,
+                 shared_cache: Optional[SharedCache] = None):
         self.api_url = api_url
         self.models = {
             "shounen": "anythingV5_PrtRE",
@@ -22,51 +64,106 @@ class StableDiffusionGenerator:
             "horror": "deliberate_v2"
         }
         
-        # Create output directory
-        self.output_dir = Path("./generated_images")
-        self.output_dir.mkdir(exist_ok=True)
+        # Content-addressed output store (local shards or an object store)
+        self.image_store = image_store or get_image_store()
+        self.references = ReferenceImageCache(self.image_store)
+        # Cleared when the API rejects ControlNet units (extension not installed)
+        self.references_supported = SD_REFERENCE_ENABLED
+        # Host-wide state: SD health, and renders in flight in any worker process
+        self.shared_cache = shared_cache or get_shared_cache()
+        self._health_key = f"sd_health:{api_url}"
+        self.in_flight = SingleFlight("generate_panel", shared=self.shared_cache)
     
-    def generate_panel(self, scene_data: Dict[str, Any], style: str = "shounen") -> Dict[str, Any]:
-        """Generate a manga panel from scene data"""
+    @traced("sd.generate_panel")
+    def generate_panel(self, scene_data: Dict[str, Any], style: str = "shounen",
+                       render: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Generate a manga panel from scene data.
+        
+        `render` picks the mode: {"mode": "draft", "seed": n} for a quick
+        preview, or {"mode": "final", "method": "hires"|"img2img", "seed": n,
+        "draft": <draft render metadata>} to finish an approved draft.
+        """
+        render = render or {}
         try:
             # Build prompt
             prompt = self._build_prompt(scene_data, style)
             negative_prompt = self._build_negative_prompt(style)
             
-            # Check if API is available, otherwise use fallback
-            if self._is_api_available():
-                image_data = self._generate_with_api(prompt, negative_prompt, style)
-            else:
-                logger.warning("Stable Diffusion API not available, using fallback image")
-                image_data = self._generate_fallback_image(scene_data)
-            
-            # Save image
-            image_path = self._save_image(image_data, scene_data.get('id', 'unknown'))
+            if not SD_COALESCE_ENABLED:
+                return self._render_panel(prompt, negative_prompt, scene_data, style, render)
             
-            return {
-                'image_url': f'/images/{Path(image_path).name}',
-                'prompt_used': prompt,
-                'negative_prompt': negative_prompt,
-                'model': self.models.get(style, 'default'),
-                'generation_metadata': {
-                    'style': style,
+            # Keyed like the panel fingerprint, but on the prompt as CLIP sees it
+            # (lower-cased, spacing collapsed): same tokens and settings, same art
+            key = self._fingerprint_of(
+                _normalize_prompt(prompt), _normalize_prompt(negative_prompt), scene_data, style, render
+            )
+            result, shared = self.in_flight.do(
+                key, lambda: self._render_panel(prompt, negative_prompt, scene_data, style, render)
+            )
+            if shared:
+                result['generation_metadata'].update({
                     'scene_type': scene_data.get('scene_type'),
-                    'mood': scene_data.get('mood')
-                }
-            }
+                    'mood': scene_data.get('mood'),
+                    'coalesced': True
+                })
+            return result
             
         except Exception as e:
             logger.error(f"Error generating panel: {str(e)}")
+            SD_ERRORS.inc()
+            # Don't trust a cached "up" after a failure; the next panel checks again
+            self.shared_cache.delete(self._health_key)
+            FALLBACK_IMAGES.labels("error").inc()
             # Return fallback
-            fallback_path = self._generate_fallback_image(scene_data)
+            fallback_name = self._generate_fallback_image(scene_data)
             return {
-                'image_url': f'/images/{Path(fallback_path).name}',
+                'image_url': self.image_store.url_for(fallback_name),
                 'prompt_used': f"Fallback for: {scene_data.get('id')}",
                 'error': str(e)
             }
     
+    def _render_panel(self, prompt: str, negative_prompt: str, scene_data: Dict[str, Any],
+                      style: str, render: Dict[str, Any]) -> Dict[str, Any]:
+        """Render (or fall back), store and describe one panel"""
+        # Check if API is available, otherwise use fallback
+        if self._is_api_available():
+            references = self._reference_images(scene_data)
+            image_data = self._generate_with_api(prompt, negative_prompt, style, references, render)
+            fallback = False
+        else:
+            logger.warning("Stable Diffusion API not available, using fallback image")
+            FALLBACK_IMAGES.labels("unavailable").inc()
+            image_data = self._generate_fallback_image(scene_data)
+            fallback = True
+        
+        # Save image
+        image_name = self._save_image(image_data, scene_data.get('id', 'unknown'))
+        
+        return {
+            'image_url': self.image_store.url_for(image_name),
+            'prompt_used': prompt,
+            'negative_prompt': negative_prompt,
+            'model': self.models.get(style, 'default'),
+            'generation_metadata': {
+                'style': style,
+                'scene_type': scene_data.get('scene_type'),
+                'mood': scene_data.get('mood'),
+                'reference_images': [
+                    char['image_ref'] for char in scene_data.get('characters') or [] if char.get('image_ref')
+                ],
+                'render': self._render_metadata(render),
+                'fallback': fallback
+            }
+        }
+    
+    @timed_stage("build_prompt")
+    @traced("sd.build_prompt")
     def _build_prompt(self, scene_data: Dict[str, Any], style: str) -> str:
         """Build Stable Diffusion prompt from scene data"""
+        return self._prompt_text(scene_data, style)
+    
+    def _prompt_text(self, scene_data: Dict[str, Any], style: str) -> str:
+        """_build_prompt without the stage timing, for callers that don't render"""
         prompt_parts = []
         
         # Base style
@@ -124,30 +221,156 @@ class StableDiffusionGenerator:
         ]
         return ", ".join([elem for elem in negative_elements if elem])
     
+    def _reference_images(self, scene_data: Dict[str, Any]) -> List[str]:
+        """Encoded reference images of the scene's characters that have one"""
+        if not self.references_supported:
+            return []
+        references = []
+        for char in scene_data.get('characters') or []:
+            if char.get('image_ref') and len(references) < SD_MAX_REFERENCES:
+                encoded = self.references.get(char['image_ref'])
+                if encoded:
+                    references.append(encoded)
+        return references
+    
+    def fingerprint(self, scene_data: Dict[str, Any], style: str = "shounen",
+                    render: Optional[Dict[str, Any]] = None) -> str:
+        """Hash of everything that decides a panel's art; equal fingerprints mean reusable art"""
+        return self._fingerprint_of(
+            self._prompt_text(scene_data, style), self._build_negative_prompt(style), scene_data, style, render or {}
+        )
+    
+    def _fingerprint_of(self, prompt: str, negative_prompt: str, scene_data: Dict[str, Any],
+                        style: str, render: Dict[str, Any]) -> str:
+        key = {
+            'prompt': prompt,
+            'negative_prompt': negative_prompt,
+            'model': self.models.get(style, 'default'),
+            'render': self._render_metadata(render),
+            'source': (render.get('draft') or {}).get('image'),
+            'references': [char.get('image_ref') for char in scene_data.get('characters') or [] if char.get('image_ref')],
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def _render_metadata(self, render: Dict[str, Any]) -> Dict[str, Any]:
+        """What a later final pass needs to reproduce this render"""
+        mode = render.get('mode', 'standard')
+        width, height = draft_size() if mode == 'draft' else (PANEL_WIDTH, PANEL_HEIGHT)
+        metadata = {
+            'mode': mode,
+            'seed': render.get('seed', -1),
+            'width': width,
+            'height': height,
+            'steps': DRAFT_STEPS if mode == 'draft' else PANEL_STEPS,
+        }
+        if mode == 'final':
+            metadata['method'] = render.get('method', 'hires')
+        return metadata
+    
+    def _render_payload(self, render: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """SD endpoint and size/steps/seed settings for a render mode"""
+        mode = render.get('mode', 'standard')
+        seed = render.get('seed', -1)
+        if mode == 'draft':
+            width, height = draft_size()
+            return "txt2img", {"width": width, "height": height, "steps": DRAFT_STEPS, "seed": seed}
+        
+        if mode == 'final':
+            draft = render['draft']
+            if render.get('method') == 'img2img':
+                with self.image_store.open(draft['image']) as f:
+                    init_image = base64.b64encode(f.read()).decode('ascii')
+                return "img2img", {
+                    "init_images": [init_image],
+                    "denoising_strength": FINAL_DENOISING_STRENGTH,
+                    "width": PANEL_WIDTH,
+                    "height": PANEL_HEIGHT,
+                    "steps": PANEL_STEPS,
+                    "seed": seed,
+                }
+            # Same seed, size and steps as the draft reproduce its composition;
+            # the hires pass then upscales and refines it
+            return "txt2img", {
+                "width": draft['width'],
+                "height": draft['height'],
+                "steps": draft['steps'],
+                "seed": seed,
+                "enable_hr": True,
+                "hr_scale": PANEL_WIDTH / draft['width'],
+                "hr_upscaler": SD_HIRES_UPSCALER,
+                "hr_second_pass_steps": PANEL_STEPS,
+                "denoising_strength": FINAL_DENOISING_STRENGTH,
+            }
+        
+        return "txt2img", {"width": PANEL_WIDTH, "height": PANEL_HEIGHT, "steps": PANEL_STEPS, "seed": seed}
+    
+    def warm_up(self, style: str = "shounen") -> bool:
+        """Load a style's checkpoint ahead of time; False if the API is down"""
+        if not self._is_api_available():
+            return False
+        response = requests.post(
+            f"{self.api_url}/sdapi/v1/options",
+            json={"sd_model_checkpoint": self.models.get(style, self.models["shounen"])},
+            timeout=SD_WARMUP_TIMEOUT
+        )
+        response.raise_for_status()
+        return True
+    
     def _is_api_available(self) -> bool:
-        """Check if Stable Diffusion API is available"""
+        """Check if Stable Diffusion API is available (shared by all workers for SD_HEALTH_TTL)"""
+        available = self.shared_cache.get(self._health_key)
+        if available is None:
+            available = self._ping()
+            self.shared_cache.set(self._health_key, available, ttl=SD_HEALTH_TTL)
+        return available
+    
+    @timed_stage("sd_health_check")
+    @traced("sd.health_check")
+    def _ping(self) -> bool:
         try:
             response = requests.get(f"{self.api_url}/internal/ping", timeout=5)
             return response.status_code == 200
         except:
             return False
     
-    def _generate_with_api(self, prompt: str, negative_prompt: str, style: str) -> bytes:
+    @timed_stage("sd_generate")
+    @traced("sd.txt2img")
+    def _generate_with_api(self, prompt: str, negative_prompt: str, style: str,
+                           references: Optional[List[str]] = None,
+                           render: Optional[Dict[str, Any]] = None) -> bytes:
         """Generate image using Stable Diffusion API"""
+        endpoint, settings = self._render_payload(render or {})
         payload = {
             "prompt": prompt,
             "negative_prompt": negative_prompt,
-            "steps": 20,
             "cfg_scale": 7,
-            "width": 512,
-            "height": 768,  # Manga panel aspect ratio
             "sampler_name": "DPM++ 2M Karras",
-            "seed": -1,
             "batch_size": 1,
-            "n_iter": 1
+            "n_iter": 1,
+            **settings
         }
         
-        response = requests.post(f"{self.api_url}/sdapi/v1/txt2img", json=payload, timeout=60)
+        if references:
+            payload["alwayson_scripts"] = {"controlnet": {"args": [
+                {
+                    "enabled": True,
+                    "image": reference,
+                    "module": SD_REFERENCE_MODULE,
+                    "model": "None",
+                    "weight": SD_REFERENCE_WEIGHT,
+                    "resize_mode": "Crop and Resize",
+                    "control_mode": "Balanced",
+                    "pixel_perfect": True
+                }
+                for reference in references
+            ]}}
+        
+        response = requests.post(f"{self.api_url}/sdapi/v1/{endpoint}", json=payload, timeout=60)
+        if references and response.status_code == 422:
+            # No ControlNet extension: stop sending units, keep generating
+            logger.warning(f"Stable Diffusion rejected reference images, disabling them: {response.text[:200]}")
+            self.references_supported = False
+            return self._generate_with_api(prompt, negative_prompt, style, render=render)
         response.raise_for_status()
         
         result = response.json()
@@ -165,23 +388,15 @@ class StableDiffusionGenerator:
         # Create image with scene info
         img = Image.new('RGB', (width, height), color='white')
         
-        # For now, just save the placeholder
-        filename = f"fallback_{scene_data.get('id', 'unknown')}.png"
-        filepath = self.output_dir / filename
-        img.save(filepath)
-        
-        return str(filepath)
+        # Identical placeholders share one content-addressed file
+        return self.image_store.save_image(img, prefix="fallback")
     
+    @timed_stage("save_image")
+    @traced("image_store.save")
     def _save_image(self, image_data: bytes, scene_id: str) -> str:
-        """Save generated image to disk"""
-        filename = f"panel_{scene_id}_{hash(image_data) % 10000}.png"
-        filepath = self.output_dir / filename
-        
+        """Store generated image under a content-hashed name"""
         if isinstance(image_data, bytes):
-            with open(filepath, 'wb') as f:
-                f.write(image_data)
-        else:
-            # If it's already a file path string
-            return image_data
-            
-        return str(filepath)
\ No newline at end of file
+            return self.image_store.save(image_data, prefix="panel")
+        
+        # Already stored (fallback image name)
+        return image_data
\ No newline at end of file
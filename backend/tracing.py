@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import secrets
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: with TRACING_ENABLED unset, span() hands back a shared no-op and
+# traced() returns the function untouched, so instrumented code pays nothing.
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+# "file" appends OTLP/JSON lines to TRACE_FILE; "otlp" posts them to an OTLP/HTTP collector
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'file')
+TRACE_FILE = os.environ.get('TRACE_FILE', './traces.jsonl')
+OTLP_ENDPOINT = os.environ.get('OTLP_ENDPOINT', 'http://127.0.0.1:4318/v1/traces')
+TRACE_EXPORT_BATCH = int(os.environ.get('TRACE_EXPORT_BATCH', 256))
+TRACE_EXPORT_INTERVAL_SECONDS = float(os.environ.get('TRACE_EXPORT_INTERVAL_SECONDS', 5))
+SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'manga-creator-api')
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation; a child of whatever span was current when it started"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"] = None,
+                 trace_id: Optional[str] = None, parent_id: Optional[str] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else (trace_id or secrets.token_hex(16))
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else parent_id
+        self.attributes = attributes
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        self.finish()
+        return False
+
+    def finish(self):
+        """End the span and queue it for export; later calls do nothing"""
+        if not self.end_ns:
+            self.end_ns = time.time_ns()
+            _exporter.submit(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """Context manager for a span nested under the current one"""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attributes, parent=_current_span.get())
+
+
+def traced(name: str):
+    """Decorator wrapping every call in a span; the identity when tracing is off"""
+    def decorator(func):
+        if not TRACING_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(name, {}, parent=_current_span.get()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _parse_traceparent(value: Optional[str]):
+    parts = (value or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    return parts[1], parts[2]
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class _SpanExporter:
+    """Batches finished spans and writes them from a background thread"""
+
+    def __init__(self):
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, finished: Span):
+        self._queue.put(finished)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch, closed = self._drain()
+            if batch:
+                self._export(batch)
+
+    def close(self):
+        """Export everything queued so far; called at interpreter exit"""
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+    def _drain(self) -> Tuple[List[Span], bool]:
+        """Up to one batch of spans, waiting at most one export interval; True once closed"""
+        batch = []
+        deadline = time.monotonic() + TRACE_EXPORT_INTERVAL_SECONDS
+        while len(batch) < TRACE_EXPORT_BATCH:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _export(self, batch: List[Span]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "manga_creator"}, "spans": [s.to_otlp() for s in batch]}],
+        }]}
+        try:
+            if TRACE_EXPORTER == "otlp":
+                requests.post(OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
+            else:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans: {str(e)}")
+
+
+_exporter = _SpanExporter()
+
+
+class TracingMiddleware:
+    """Root span per HTTP request, continuing an incoming W3C traceparent.
+
+    The span ends when the response body is sent, but stays current so a
+    background job started by the request is recorded as its child.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        trace_id, parent_id = _parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        request_span = Span(
+            f"{scope['method']} {scope['path']}",
+            {"http.method": scope["method"], "http.target": scope["path"]},
+            trace_id=trace_id,
+            parent_id=parent_id,
+        )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                request_span.set_attribute("http.status_code", message["status"])
+                route = scope.get("route")
+                if route is not None:
+                    request_span.name = f"{scope['method']} {route.path}"
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                request_span.finish()
+
+        with request_span:
+            await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'true').lower() == 'true'
+WARMUP_STYLE = os.environ.get('WARMUP_STYLE', 'shounen')
+WARMUP_DB_CONNECTIONS = int(os.environ.get('WARMUP_DB_CONNECTIONS', 4))
+
+
+class StartupState:
+    """What has been initialised so far, for the readiness endpoint"""
+
+    def __init__(self):
+        self.schema_ready = False
+        self.warmup_done = False
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def ready(self) -> bool:
+        # A failed warm-up step (e.g. SD offline) doesn't block traffic: the
+        # fallback path still works, it's just slower the first time
+        return self.schema_ready and self.warmup_done
+
+    def record_timing(self, phase: str, seconds: float):
+        self.timings[phase] = round(seconds, 4)
+        STARTUP_SECONDS.labels(phase).set(seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "schema_ready": self.schema_ready,
+            "warmup_done": self.warmup_done,
+            "warmup": self.steps,
+            "startup_seconds": self.timings,
+        }
+
+
+async def _run_step(state: StartupState, name: str, step: Callable) -> None:
+    started = time.perf_counter()
+    try:
+        result = await step()
+        if result is False:
+            state.steps[name] = {"status": "skipped", "detail": "unavailable"}
+        else:
+            state.steps[name] = {"status": "ok", "detail": result}
+    except Exception as e:
+        logger.warning(f"Warm-up step {name} failed: {str(e)}")
+        state.steps[name] = {"status": "failed", "detail": str(e)}
+    state.steps[name]["seconds"] = round(time.perf_counter() - started, 4)
+
+
+async def warm_up(state: StartupState, async_engine, sd_generator, prime_process_pool: Callable[[], int]):
+    """Prime connections, worker processes and the SD checkpoint, concurrently"""
+    started = time.perf_counter()
+
+    async def prime_db_pool():
+        async def ping():
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        await asyncio.gather(*[ping() for _ in range(WARMUP_DB_CONNECTIONS)])
+        return WARMUP_DB_CONNECTIONS
+
+    async def prime_workers():
+        return await run_in_threadpool(prime_process_pool)
+
+    async def load_sd_model():
+        return await run_in_threadpool(sd_generator.warm_up, WARMUP_STYLE)
+
+    await asyncio.gather(
+        _run_step(state, "db_pool", prime_db_pool),
+        _run_step(state, "worker_processes", prime_workers),
+        _run_step(state, "sd_model", load_sd_model),
+    )
+    state.warmup_done = True
+    state.record_timing("warmup", time.perf_counter() - started)
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s: {state.steps}")
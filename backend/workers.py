@@ -0,0 +1,60 @@
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Shared pool for CPU-bound image work (created on first use)"""
+    global _process_pool
+    if _process_pool is None:
+        max_workers = pool_size()
+        _process_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=_start_context())
+        logger.info(f"Started image worker pool with {max_workers} processes")
+    return _process_pool
+
+
+# Modules holding the functions submitted to the pool
+TASK_MODULES = ["bulk_import", "lettering", "page_composer"]
+
+
+def _start_context() -> multiprocessing.context.BaseContext:
+    # Not fork: by now the server runs threads (aiosqlite, the threadpool, the
+    # trace exporter) and a child could inherit one of their locks held.
+    # The fork server imports just the task modules, not __main__ or the app,
+    # and forks each worker from that single-threaded process.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(TASK_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def pool_size() -> int:
+    return int(os.environ.get('MANGA_WORKER_PROCESSES', 0)) or os.cpu_count() or 1
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+
+
+def _warm_worker() -> int:
+    # Long enough that each submission lands on a different, freshly started process
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def prime_process_pool() -> int:
+    """Start every worker process now instead of on the first request; returns how many"""
+    pool = get_process_pool()
+    futures = [pool.submit(_warm_worker) for _ in range(pool_size())]
+    return len({future.result() for future in futures})
@@ -358,6 +358,32 @@ class MangaCreatorTester:
             self.log_result("Static Files", False, "Request failed", str(e))
         return False
     
+    def test_export_manga(self):
+        """Test 12: Export - Stream Manga as ZIP"""
+        if not self.created_script_id:
+            self.log_result("Export Manga", False, "No script ID available for export")
+            return False
+            
+        try:
+            response = self.session.get(f"{self.base_url}/export/manga/{self.created_script_id}", params={"format": "zip"}, stream=True)
+            if response.status_code == 200:
+                content_type = response.headers.get('content-type', '')
+                first_bytes = next(response.iter_content(4), b'')
+                if content_type.startswith('application/zip') and first_bytes == b'PK\x03\x04':
+                    self.log_result("Export Manga", True, "ZIP export streaming correctly")
+                    return True
+                else:
+                    self.log_result("Export Manga", False, "Unexpected export payload", f"{content_type} {first_bytes!r}")
+            elif response.status_code == 404:
+                # Generation may still be running; no panels yet is a valid state
+                self.log_result("Export Manga", True, "No panels generated yet (404)")
+                return True
+            else:
+                self.log_result("Export Manga", False, f"HTTP {response.status_code}", response.text)
+        except Exception as e:
+            self.log_result("Export Manga", False, "Request failed", str(e))
+        return False
+    
     def run_all_tests(self):
         """Run all backend tests"""
         print(f"🚀 Starting Manga Creator Backend API Tests")
@@ -375,7 +401,8 @@ class MangaCreatorTester:
             self.test_generate_manga,
             self.test_generation_status,
             self.test_error_handling,
-            self.test_static_files
+            self.test_static_files,
+            self.test_export_manga
         ]
         
         passed = 0
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card } from './ui/card';
 import { Button } from './ui/button';
 import { Progress } from './ui/progress';
@@ -19,18 +19,19 @@ export default function MangaPreview({ script, style, isGenerating: externalGene
   const [zoomLevel, setZoomLevel] = useState(1);
   const [isAutoPlaying, setIsAutoPlaying] = useState(false);
   const [error, setError] = useState(null);
-  const [pollInterval, setPollInterval] = useState(null);
+  // Job being polled; a poll chain stops once this no longer names its job
+  const pollingJob = useRef(null);
+  const pollTimeout = useRef(null);
 
   const { toast } = useToast();
 
   // Clean up polling on unmount
   useEffect(() => {
     return () => {
-      if (pollInterval) {
-        clearInterval(pollInterval);
-      }
+      pollingJob.current = null;
+      clearTimeout(pollTimeout.current);
     };
-  }, [pollInterval]);
+  }, []);
 
   // Handle external generation trigger
   useEffect(() => {
@@ -78,20 +79,52 @@ export default function MangaPreview({ script, style, isGenerating: externalGene
   };
 
   const startPollingProgress = (jobId) => {
-    const interval = setInterval(async () => {
+    pollingJob.current = jobId;
+    clearTimeout(pollTimeout.current);
+    // Each poll only fetches panels finished since the previous one
+    let since = 0;
+    const seen = new Set();
+    const fetchNewPanels = async () => {
+      const status = await generationAPI.getGenerationStatus(jobId, since);
+      if (pollingJob.current !== jobId) {
+        return null;
+      }
+      // Legacy jobs' panels may have no id; their position is unique too
+      const fresh = (status.panels || []).filter((panel) => {
+        const key = panel.panel_id ?? `index:${panel.index}`;
+        if (seen.has(key)) {
+          return false;
+        }
+        seen.add(key);
+        return true;
+      });
+      if (fresh.length > 0) {
+        setPanels((previous) => [...previous, ...fresh]);
+      }
+      since = status.next_since;
+      return status;
+    };
+
+    // The next poll is scheduled only once this one is done, so two never overlap
+    const poll = async () => {
       try {
-        const status = await generationAPI.getGenerationStatus(jobId);
+        let status = await fetchNewPanels();
+        if (!status) {
+          return;
+        }
         setGenerationJob(status);
         
         if (status.status === 'completed') {
           setIsGenerating(false);
-          clearInterval(interval);
-          setPollInterval(null);
           
-          // Extract panels from result
-          if (status.result_data && status.result_data.panels) {
-            setPanels(status.result_data.panels);
+          // Large jobs can finish with more than one page still unread
+          while (since < status.panel_count && status.panels.length > 0) {
+            status = await fetchNewPanels();
+            if (!status) {
+              return;
+            }
           }
+          pollingJob.current = null;
           
           if (onGenerationComplete) {
             onGenerationComplete(status);
@@ -101,11 +134,11 @@ export default function MangaPreview({ script, style, isGenerating: externalGene
             title: "Generation Complete",
             description: "Your manga has been successfully generated!",
           });
+          return;
           
         } else if (status.status === 'failed') {
           setIsGenerating(false);
-          clearInterval(interval);
-          setPollInterval(null);
+          pollingJob.current = null;
           setError(status.error_message || 'Generation failed');
           
           toast({
@@ -113,13 +146,17 @@ export default function MangaPreview({ script, style, isGenerating: externalGene
             description: status.error_message || 'An error occurred during generation',
             variant: "destructive",
           });
+          return;
         }
       } catch (error) {
         console.error('Error polling generation status:', error);
       }
-    }, 2000);
+      if (pollingJob.current === jobId) {
+        pollTimeout.current = setTimeout(poll, 2000);
+      }
+    };
 
-    setPollInterval(interval);
+    pollTimeout.current = setTimeout(poll, 2000);
   };
 
   const getProgressPercentage = () => {
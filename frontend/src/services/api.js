@@ -32,6 +32,15 @@ export const scriptAPI = {
     }
   },
 
+  searchScripts: async (query, { limit = 20, offset = 0 } = {}) => {
+    try {
+      const response = await apiClient.get('/scripts/search', { params: { q: query, limit, offset } });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to search scripts');
+    }
+  },
+
   getScript: async (scriptId) => {
     try {
       const response = await apiClient.get(`/scripts/${scriptId}`);
@@ -40,6 +49,24 @@ export const scriptAPI = {
       throw new Error(error.response?.data?.detail || 'Failed to fetch script');
     }
   },
+
+  updateScript: async (scriptId, scriptData) => {
+    try {
+      const response = await apiClient.put(`/scripts/${scriptId}`, scriptData);
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to update script');
+    }
+  },
+
+  importScripts: async (scripts) => {
+    try {
+      const response = await apiClient.post('/scripts/bulk', { scripts });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to import scripts');
+    }
+  },
 };
 
 // Character Management
@@ -70,6 +97,35 @@ export const characterAPI = {
       throw new Error(error.response?.data?.detail || 'Failed to delete character');
     }
   },
+
+  searchCharacters: async (query, { tags = [], match = 'all', limit = 20, offset = 0 } = {}) => {
+    try {
+      const response = await apiClient.get('/characters/search', {
+        params: { q: query || undefined, tags: tags.join(',') || undefined, match, limit, offset },
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to search characters');
+    }
+  },
+
+  resolveCharacters: async ({ names = [], scriptId } = {}) => {
+    try {
+      const response = await apiClient.post('/characters/resolve', { names, script_id: scriptId });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to resolve characters');
+    }
+  },
+
+  importCharacters: async (characters) => {
+    try {
+      const response = await apiClient.post('/characters/bulk', { characters });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to import characters');
+    }
+  },
 };
 
 // Manga Generation
@@ -96,9 +152,31 @@ export const generationAPI = {
     }
   },
 
-  getGenerationStatus: async (jobId) => {
+  regenerateScene: async (scriptId, order, style, options = {}) => {
+    try {
+      const response = await apiClient.post(`/scripts/${scriptId}/scenes/${order}/regenerate`, { style, options });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to regenerate scene');
+    }
+  },
+
+  startFinalGeneration: async (scriptId, panelIds, method = 'hires') => {
+    try {
+      const response = await apiClient.post('/generate/final', {
+        script_id: scriptId,
+        panel_ids: panelIds,
+        method
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.detail || 'Failed to start final render');
+    }
+  },
+
+  getGenerationStatus: async (jobId, since = 0, limit = 100) => {
     try {
-      const response = await apiClient.get(`/generate/status/${jobId}`);
+      const response = await apiClient.get(`/generate/status/${jobId}`, { params: { since, limit } });
       return response.data;
     } catch (error) {
       throw new Error(error.response?.data?.detail || 'Failed to get generation status');
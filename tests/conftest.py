@@ -0,0 +1,59 @@
+import os
+import sys
+import asyncio
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# The backend reads its configuration at import, so point it at scratch
+# storage before any test imports it
+_scratch = tempfile.mkdtemp(prefix="manga_tests_")
+os.environ.update({
+    "MONGO_URL": f"sqlite:///{_scratch}/manga_creator.db",
+    "IMAGE_STORAGE_ROOT": f"{_scratch}/images",
+    "SHARED_CACHE_PATH": f"{_scratch}/shared_cache.db",
+    "WARMUP_ENABLED": "false",
+    "IMAGE_GC_ENABLED": "false",
+    "ADMISSION_ENABLED": "false",
+})
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import server
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def fake_sd(monkeypatch):
+    """Stable Diffusion stubbed out: every render returns a small PNG; calls are recorded"""
+    import io
+    from PIL import Image
+    import server
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 96), "white").save(buffer, format="PNG")
+    calls = []
+
+    def generate_with_api(prompt, negative_prompt, style, references=None, render=None):
+        calls.append(render or {})
+        return buffer.getvalue()
+
+    generator = server.get_sd_generator()
+    monkeypatch.setattr(generator, "_is_api_available", lambda: True)
+    monkeypatch.setattr(generator, "_generate_with_api", generate_with_api)
+
+    # Jobs pause between rendered panels; not while testing
+    real_sleep = asyncio.sleep
+
+    async def no_sleep(*args, **kwargs):
+        await real_sleep(0)
+    monkeypatch.setattr(server.asyncio, "sleep", no_sleep)
+    return calls
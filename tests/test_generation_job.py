@@ -0,0 +1,39 @@
+import server
+
+SCRIPT = """[SCENE: Rooftop - Dusk]
+[ACTION: Rei watches the city lights]
+[DIALOGUE: Rei] "Tomorrow it begins."
+[SCENE: Train Station - Morning]
+[ACTION: Sora waves from the platform]
+"""
+
+
+def _run(client, payload):
+    response = client.post("/api/generate/manga", json=payload)
+    assert response.status_code == 200, response.text
+    return client.get(f"/api/generate/status/{response.json()['job_id']}").json()
+
+
+def test_failed_panel_is_skipped_and_the_job_completes(client, fake_sd, monkeypatch):
+    script = client.post("/api/scripts/parse", json={"title": "Skip", "content": SCRIPT, "style": "shounen"}).json()
+    request = {"script_id": script["id"], "style": "shounen"}
+    first = _run(client, request)
+    assert first["status"] == "completed"
+
+    generator = server.get_sd_generator()
+    fingerprint = generator.fingerprint
+    failures = []
+
+    def fail_once(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("boom")
+        return fingerprint(*args, **kwargs)
+    monkeypatch.setattr(generator, "fingerprint", fail_once)
+
+    # The first scene fails; the second still reuses its panel from the first run
+    status = _run(client, request)
+    assert status["status"] == "completed", status
+    assert status["result_data"]["reused_panels"] == 1
+    assert status["panel_count"] == 1
+    assert status["panels"][0]["panel_id"] == first["panels"][1]["panel_id"]
@@ -0,0 +1,94 @@
+import json
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from migrations import run_migrations
+from models import decompress_value
+
+# The database committed with the original app: baseline schema, and jobs
+# whose panel summaries were written before their panels had ids
+BASELINE_DB = Path(__file__).resolve().parent.parent / "backend" / "manga_creator.db"
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = tmp_path / "manga_creator.db"
+    shutil.copy(BASELINE_DB, path)
+    with sqlite3.connect(path) as conn:
+        legacy = {
+            job_id: json.loads(result_data)["panels"]
+            for job_id, result_data in conn.execute("SELECT id, result_data FROM generation_jobs")
+        }
+    assert legacy and all(panel["panel_id"] is None for panels in legacy.values() for panel in panels)
+    return path, legacy
+
+
+def _migrate(path):
+    engine = create_engine(f"sqlite:///{path}")
+    run_migrations(engine)
+    engine.dispose()
+
+
+def _job_panels(conn, job_id):
+    return conn.execute(
+        "SELECT panels.id, panels.scene_id, panels.image_url FROM job_panels "
+        "JOIN panels ON panels.id = job_panels.panel_id WHERE job_id = ? ORDER BY position",
+        (job_id,)
+    ).fetchall()
+
+
+def _result_data(conn, job_id):
+    value = conn.execute("SELECT result_data FROM generation_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    return json.loads(decompress_value(value))
+
+
+def test_legacy_job_panels_become_rows(baseline):
+    path, legacy = baseline
+    _migrate(path)
+
+    with sqlite3.connect(path) as conn:
+        seen = set()
+        for job_id, panels in legacy.items():
+            rows = _job_panels(conn, job_id)
+            assert [(scene_id, image_url) for _, scene_id, image_url in rows] == \
+                [(panel["scene_id"], panel["image_url"]) for panel in panels]
+            # Jobs that produced the same image still point at their own panels
+            assert not seen & {panel_id for panel_id, _, _ in rows}
+            seen.update(panel_id for panel_id, _, _ in rows)
+            assert "panels" not in _result_data(conn, job_id)
+
+
+def test_unmatched_legacy_jobs_keep_their_summaries(baseline):
+    path, legacy = baseline
+    job_id, panels = next(iter(legacy.items()))
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE panels SET image_url = 'gone' WHERE scene_id = ?", (panels[0]["scene_id"],))
+    _migrate(path)
+
+    with sqlite3.connect(path) as conn:
+        assert _job_panels(conn, job_id) == []
+        assert _result_data(conn, job_id)["panels"] == panels
+
+
+def test_status_serves_unmatched_legacy_summaries(client):
+    from database import SessionLocal
+    from models import GenerationJob
+
+    panels = [{"panel_id": None, "scene_id": f"scene-{i}", "image_url": f"/images/old_{i}.png", "prompt": "p"}
+              for i in range(3)]
+    with SessionLocal() as db:
+        job = GenerationJob(script_id="legacy", status="completed", progress=1.0, result_data={"panels": panels})
+        db.add(job)
+        db.commit()
+        job_id = job.id
+
+    status = client.get(f"/api/generate/status/{job_id}?since=1&limit=1").json()
+    assert status["panel_count"] == 3
+    assert status["panels"] == [{**panels[1], "index": 1}]
+    assert status["next_since"] == 2
+    # The page is the only copy of the summaries in the response
+    assert status["result_data"] == {}
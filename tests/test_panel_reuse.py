@@ -0,0 +1,44 @@
+SCRIPT = """[SCENE: Dojo - Night]
+[CHARACTER: Akira - young swordsman]
+[ACTION: Akira draws his sword]
+[DIALOGUE: Akira] "I will protect this village!"
+[SCENE: Village Market - Day]
+[ACTION: Yumi runs through the market]
+"""
+
+
+def _run(client, path, payload):
+    response = client.post(path, json=payload)
+    assert response.status_code == 200, response.text
+    # Background tasks finish before the test client returns
+    status = client.get(f"/api/generate/status/{response.json()['job_id']}").json()
+    assert status["status"] == "completed", status
+    return status
+
+
+def test_reuse_survives_draft_and_final_passes(client, fake_sd):
+    script = client.post("/api/scripts/parse", json={"title": "Reuse", "content": SCRIPT, "style": "shounen"}).json()
+    standard = {"script_id": script["id"], "style": "shounen"}
+    draft = {**standard, "options": {"mode": "draft"}}
+
+    first = _run(client, "/api/generate/manga", standard)
+    assert len(fake_sd) == 2
+
+    drafts = _run(client, "/api/generate/manga", draft)
+    assert len(fake_sd) == 4
+    # The same draft request again renders nothing
+    repeated = _run(client, "/api/generate/manga", draft)
+    assert repeated["result_data"]["reused_panels"] == 2
+    assert len(fake_sd) == 4
+
+    _run(client, "/api/generate/final", {
+        "script_id": script["id"], "method": "hires", "panel_ids": [panel["panel_id"] for panel in drafts["panels"]]
+    })
+    assert len(fake_sd) == 6
+
+    # The standard panels still match, although drafts and finals came after them
+    rerun = _run(client, "/api/generate/manga", standard)
+    assert rerun["result_data"]["reused_panels"] == 2
+    assert len(fake_sd) == 6
+
+    assert [panel["image_url"] for panel in rerun["panels"]] == [panel["image_url"] for panel in first["panels"]]
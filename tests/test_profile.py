@@ -0,0 +1,6 @@
+def test_failed_profile_request_releases_the_profiler(client):
+    response = client.post("/api/admin/profile", params={"job_id": "missing"})
+    assert response.status_code == 404
+
+    response = client.post("/api/admin/profile", params={"seconds": 0, "format": "json"})
+    assert response.status_code == 200, response.text
@@ -0,0 +1,93 @@
+import io
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+import image_store
+from image_server import ImmutableImageFiles
+from image_store import S3ImageStore
+
+BUCKET = "manga-images"
+
+
+def _png(color="red", size=(96, 64)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    # moto stands in for S3; boto3 only needs some credentials to sign with
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3ImageStore(BUCKET, prefix="images", region_name="us-east-1")
+
+
+def test_save_stat_scan_and_remove(store):
+    data = _png()
+    name = store.save(data)
+    assert name == store.save(data)
+
+    stored = store.stat(name)
+    assert stored.size == len(data)
+    assert stored.key == f"images/{store.shard_for(name)}/{name}"
+    assert b"".join(store.iter_bytes(name)) == data
+    assert b"".join(store.iter_bytes(name, 1, 3)) == data[1:4]
+
+    scanned = {obj.name: obj for obj in store.scan()}
+    assert name in scanned
+
+    assert store.remove(stored.key, modified_before=time.time() - 3600) is None
+    assert store.remove(stored.key) == len(data)
+    assert store.stat(name) is None
+    assert store.remove(stored.key) is None
+
+
+def test_save_stream_writes_the_image_and_its_variants(store):
+    data = _png("blue", (512, 512))
+    name = store.save_stream(io.BytesIO(data), "upload", ".png")
+
+    assert b"".join(store.iter_bytes(name)) == data
+    assert store.stat(store.variant_name(name, "image/webp")) is not None
+
+
+def test_upload_endpoint_stores_in_s3(store, client, monkeypatch):
+    monkeypatch.setattr(image_store, "_default_store", store)
+    data = _png("green", (512, 512))
+
+    response = client.post("/api/images", files={"file": ("ref.png", data, "image/png")})
+    assert response.status_code == 200, response.text
+    name = store.name_from_url(response.json()["image_url"])
+    assert b"".join(store.iter_bytes(name)) == data
+
+
+def test_images_are_served_from_s3(store):
+    data = _png("yellow", (512, 512))
+    name = store.save(data)
+    app = Starlette(routes=[Mount("/images", ImmutableImageFiles(store))])
+
+    with TestClient(app) as client:
+        response = client.get(f"/images/{name}")
+        assert response.status_code == 200
+        assert response.content == data
+        assert response.headers["cache-control"].endswith("immutable")
+
+        response = client.get(f"/images/{name}", headers={"range": "bytes=0-9"})
+        assert response.status_code == 206
+        assert response.content == data[:10]
+
+        response = client.get(f"/images/{name}", headers={"accept": "image/webp"})
+        assert response.headers["content-type"] == "image/webp"
+        assert response.content == b"".join(store.iter_bytes(store.variant_name(name, "image/webp")))
+
+        assert client.get("/images/panel_missing.png").status_code == 404
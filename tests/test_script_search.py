@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import select
+
+import database
+import script_search
+from models import Scene
+
+SCRIPT = """[SCENE: Lighthouse - Night]
+[ACTION: Hana climbs the spiral stairs]
+[SCENE: Harbour - Dawn]
+[ACTION: Kenji mends a fishing net]
+[DIALOGUE: Kenji] "The tide waits for nobody."
+"""
+
+
+@pytest.fixture(params=["fts", "like"])
+def search_mode(request, monkeypatch):
+    if request.param == "like":
+        monkeypatch.setattr(script_search, "_enabled", False)
+    return request.param
+
+
+def test_scene_hits_carry_the_scene_id(client, search_mode):
+    script = client.post("/api/scripts/parse", json={"title": "Tides", "content": SCRIPT, "style": "shounen"}).json()
+    with database.SessionLocal() as db:
+        scenes = dict(db.execute(select(Scene.order, Scene.id).where(Scene.script_id == script["id"])).all())
+
+    results = client.get("/api/scripts/search", params={"q": "tide"}).json()["results"]
+    hits = [hit for hit in results if hit["script_id"] == script["id"] and hit["scene_order"] is not None]
+    assert hits
+    for hit in hits:
+        assert hit["scene_id"] == scenes[hit["scene_order"]]
@@ -0,0 +1,20 @@
+from prometheus_client import REGISTRY
+
+from stable_diffusion import StableDiffusionGenerator
+
+SCENE = {"id": "scene-1", "location": "Dojo", "actions": ["Akira draws his sword"], "mood": "intense"}
+
+
+def _build_prompt_count():
+    return REGISTRY.get_sample_value("manga_stage_seconds_count", {"stage": "build_prompt"}) or 0
+
+
+def test_fingerprint_is_not_timed_as_build_prompt():
+    generator = StableDiffusionGenerator()
+    before = _build_prompt_count()
+    fingerprint = generator.fingerprint(SCENE, "shounen")
+    assert _build_prompt_count() == before
+
+    assert generator._build_prompt(SCENE, "shounen") == generator._prompt_text(SCENE, "shounen")
+    assert _build_prompt_count() == before + 1
+    assert generator.fingerprint(SCENE, "shounen") == fingerprint
@@ -0,0 +1,14 @@
+import os
+
+import workers
+from bulk_import import parse_scripts
+
+
+def test_pool_workers_are_not_forked_from_the_server():
+    pool = workers.get_process_pool()
+    assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+
+    [(parsed, error)] = pool.submit(parse_scripts, ["[SCENE: Dojo - Night]\n[ACTION: Akira bows]"]).result()
+    assert error is None
+    assert parsed["total_scenes"] == 1
+    assert pool.submit(os.getpid).result() != os.getpid()